@@ -1,11 +1,15 @@
 import streamlit as st
-from pathlib import Path
 from openai import OpenAI
 import os
 from dotenv import load_dotenv
 from collections import Counter
 import re
 import random
+from mp3_splice import Mp3Splicer
+from tts_engine import SpeechRequest, fetch_speech_cached
+from clip_cache import get_default_cache
+from rate_limit import get_default_limiter
+from job_store import get_default_store
 
 # CSS 스타일 추가
 st.markdown(
@@ -153,11 +157,10 @@ Orange peels are great for cleaning surfaces."""
                     <span class="fa fa-spinner fa-spin fa-3x"></span>
                 </div><div style="color: white;">🔊음원을 출력하는 중...</div></div></div>""", unsafe_allow_html=True)
         try:
-            speech_file_path = Path("speech.mp3")
             input_text = st.session_state.input_text
             lines = input_text.split('\n')
             sentences = merge_lines(lines)
-            tts = bytearray()
+            tts = Mp3Splicer()  # MP3 프레임을 디코딩 없이 그대로 이어 붙임
             current_number = None
 
             # 초기화된 현재 여성 및 남성 목소리
@@ -199,20 +202,22 @@ Orange peels are great for cleaning surfaces."""
                 text_to_convert = f"{number[:-1]}번.\n'.....'\n {sentence}" if number else sentence
 
                 if text_to_convert.strip():
-                    response = client.audio.speech.create(
+                    # 캐시에 없을 때만 API 를 호출
+                    data, cached = fetch_speech_cached(client, SpeechRequest(
                         model="tts-1-hd",
                         voice=current_voice,
-                        input=text_to_convert
-                    )
-                    print(f"Text to convert: {text_to_convert}, Using voice: {current_voice}")
+                        text=text_to_convert,
+                        speed=None,
+                        instructions=None
+                    ), get_default_cache(), limiter=get_default_limiter())
+                    print(f"Text to convert: {text_to_convert}, Using voice: {current_voice}, cached: {cached}")
 
-                    for chunk in response.iter_bytes():
-                        tts.extend(chunk)
+                    tts.add_clip(data)
 
-                    tts.extend(b'\x00' * (st.session_state.interline * 16000 // 1000))  # Add interline interval
+                    tts.add_silence(st.session_state.interline)  # 무음 MP3 프레임으로 문장 간격 추가
 
-            with open(speech_file_path, 'wb') as audio_file:
-                audio_file.write(tts)
+            # 작업마다 따로 쓴 파일을 원자적으로 공개 (다른 세션의 음원을 덮어쓰지 않음)
+            speech_file_path = get_default_store().publish_bytes(tts.render())
 
             st.session_state.speech_file_path = str(speech_file_path)
             st.session_state.success_message = "Speech conversion successful!"
@@ -226,6 +231,10 @@ Orange peels are great for cleaning surfaces."""
         st.balloons()
 
 
+    # 오래되어 정리된 파일이면 다시 생성하도록 안내
+    if 'speech_file_path' in st.session_state and not os.path.exists(st.session_state.speech_file_path):
+        del st.session_state.speech_file_path
+
     if 'speech_file_path' in st.session_state:
         success_message.success(st.session_state.success_message)
         warning_message.warning(st.session_state.en_warning_message, icon="🚨")
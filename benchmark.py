@@ -0,0 +1,694 @@
+# 음원 생성 파이프라인 성능 측정 스크립트 (API 키 없이 가짜 클라이언트로 측정)
+# 사용법: python benchmark.py parallel assembly format formats splice streaming parser singleflight ratelimit adaptive fairness priority tail decoder streamdecode coalesce segment dedup regap
+import os
+import random
+import re
+import sys
+from io import BytesIO
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+from pydub import AudioSegment
+from pydub.generators import Sine
+
+import tts_engine
+from tts_engine import SpeechRequest, SingleFlight, HedgePolicy, synthesize_all, fetch_speech, request_key, DEFAULT_MODEL
+from audio_assembly import (Timeline, StreamingEncoder, DecodedClips, DEFAULT_FORMAT, format_of, decode_clip,
+                            decode_with_av, decode_with_ffmpeg, silence, assemble_exam, cache_clip_mp3,
+                            rebuild_exam)
+from clip_cache import ClipCache
+from planner import plan_exam, segment_text
+from coalesce import synthesize_coalesced, PAUSE_MARKER
+from mp3_splice import Mp3Splicer
+from script_parser import parse_script
+from rate_limit import RateLimiter
+from concurrency import AdaptiveConcurrency
+from scheduler import FairScheduler
+from fake_tts_server import running_server, LocalSpeechClient
+
+
+class FakeSpeechClient:
+    # client.audio.speech.with_streaming_response.create(...) 흉내: 고정 지연 후 가짜 바이트 반환
+    # chunk_size 를 주면 payload 를 그 크기로 나눠 chunk_delay 초 간격으로 흘려보낸다 (느린 네트워크 흉내)
+    def __init__(self, latency=0.05, payload=b"\xff\xf3" * 512, chunk_size=None, chunk_delay=0.0):
+        self.latency = latency
+        self.payload = payload
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.audio = self
+        self.speech = self
+        self.with_streaming_response = self
+
+    @contextmanager
+    def create(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        yield self
+
+    def iter_bytes(self):
+        size = self.chunk_size or len(self.payload)
+        for pos in range(0, len(self.payload), size):
+            if pos:
+                time.sleep(self.chunk_delay)
+            yield self.payload[pos:pos + size]
+
+    def close(self):
+        pass        # cancel.on_cancel(response.close) 용. 끊을 연결이 없다
+
+
+class BytesResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def iter_bytes(self):
+        yield self.data
+
+    def close(self):
+        pass
+
+
+class PausingSpeechClient(FakeSpeechClient):
+    # 문장마다 글자 수에 비례한 길이의 소리를, PAUSE_MARKER 자리에는 무음을 넣은 pcm 을 돌려준다.
+    # skip_ratio 비율의 요청은 문장 사이 무음을 거의 두지 않는다 (자르기 실패 흉내)
+    def __init__(self, latency=0.2, skip_ratio=0.0, seed=5):
+        super().__init__(latency)
+        self.skip_ratio = skip_ratio
+        self.random = random.Random(seed)
+
+    @contextmanager
+    def create(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+            skip = self.random.random() < self.skip_ratio
+        time.sleep(self.latency)
+        parts = [silence(100)]
+        for n, line in enumerate(kwargs["input"].split(PAUSE_MARKER)):
+            if n:
+                parts.append(silence(100 if skip else 600))
+            parts.append(Sine(300).to_audio_segment(duration=len(line) * 40, volume=-10)
+                         .set_frame_rate(24000).set_channels(1).set_sample_width(2))
+        parts.append(silence(100))
+        yield BytesResponse(b"".join(part.raw_data for part in parts))
+
+
+class LengthSpeechClient(FakeSpeechClient):
+    # 글자 수에 비례해 응답이 늦어지는 가짜 클라이언트 (긴 문장일수록 합성이 오래 걸림)
+    def __init__(self, latency=0.1, per_char=0.002):
+        super().__init__(latency)
+        self.per_char = per_char
+
+    @contextmanager
+    def create(self, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency + self.per_char * len(kwargs["input"]))
+        yield self
+
+
+def bench_segment(monologue=3000, workers=8):
+    # 줄바꿈 없는 긴 지문이 있는 시험을 (발화 하나 = 요청 하나) 와 (길이로 나눠 동시 합성) 으로 합성
+    passage = " ".join(f"The speaker describes part {i} of the museum tour, pointing out the paintings; "
+                       f"visitors should stay with the group." for i in range(monologue // 95 + 1))[:monologue]
+    script = "\n".join([f"1. W: {passage}."] + [f"{q}. M: Where is the library? W: It is next to the bank."
+                                                for q in range(2, 11)])
+    exam = parse_script(script)
+    for label, segment_chars in (("whole utterances", 0), ("segmented", None)):
+        plan = plan_exam(exam, "nova", "nova", "onyx", response_format="pcm",
+                         **({} if segment_chars is None else {"segment_chars": segment_chars}))
+        client = LengthSpeechClient()
+        _, stats = synthesize_all(client, plan.requests, max_workers=workers, flight=None)
+        longest = max(len(r.text) for r in plan.requests)
+        print(f"segment   {label:16s} {len(plan)} requests (longest {longest} chars): {stats['elapsed']:.2f}s")
+    # 어떤 길이에서 잘라도 단어 가운데를 자르지 않는다
+    for end in range(401, len(passage), 7):
+        text = passage[:end].rsplit(" ", 1)[0]
+        chunks = segment_text(text)
+        assert " ".join(chunks).split() == text.split(), [len(chunk) for chunk in chunks]
+
+
+def bench_dedup(questions=20, workers=8):
+    # 문제마다 "Number One." ~ "Number Five." 와 같은 안내가 되풀이되는 대본에서
+    # (타임라인의 문장마다 요청) 과 (같은 요청은 한 번만) 의 API 호출 수·시간, 조립한 길이 비교
+    lines = ["W: Listen carefully and choose the best answer for each question."]
+    for q in range(1, questions + 1):
+        lines.append(f"{q}. M: What will the woman do next in conversation {q}?")
+        lines.extend(f"W: Number {c}." for c in ("One", "Two", "Three", "Four", "Five"))
+        lines.append("W: Listen carefully and choose the best answer for each question.")
+    plan = plan_exam(parse_script("\n".join(lines)), "nova", "nova", "onyx", response_format="pcm")
+    spoken = [plan.requests[value] for kind, value in plan.timeline if kind == "speech"]
+    pcm = fake_clip(seconds=1.0).raw_data
+    for label, requests in (("every sentence", spoken), ("deduplicated", plan.requests)):
+        client = FakeSpeechClient(latency=0.05, payload=pcm)
+        _, stats = synthesize_all(client, requests, max_workers=workers, flight=None)
+        print(f"dedup     {label:14s} {len(spoken)} sentences: {client.calls:3d} API calls, {stats['elapsed']:.2f}s")
+    timeline = assemble_exam(plan.timeline, [pcm] * len(plan), Timeline(DEFAULT_FORMAT), "pcm", 700, 10000)
+    expected = len(spoken) * 1000 + 700 * len(spoken) + 10000 * (questions - 1)
+    assert abs(timeline.duration_ms() - expected) < 1, (timeline.duration_ms(), expected)
+    print(f"dedup     {plan.reused()} calls saved, assembled {timeline.duration_ms() / 1000:.1f}s as expected")
+
+
+def coalesce_script(questions=20):
+    # 문제마다 지시문·대화 두 줄·같은 목소리로 읽는 보기 다섯 줄
+    lines = []
+    for q in range(1, questions + 1):
+        lines.append(f"{q}. W: Listen to the conversation and choose the best response.")
+        lines.append("M: Are you going to the library this afternoon?")
+        lines.append("W: Yes, I need to return some books before Friday.")
+        lines.extend(f"Number {c}. Choice {c} for question {q}." for c in ("One", "Two", "Three", "Four", "Five"))
+    return "\n".join(lines)
+
+
+def bench_coalesce(questions=20, workers=8):
+    # 같은 목소리 문장을 묶어 요청할 때의 API 호출 수·걸린 시간, 잘라 낸 문장 길이 확인
+    exam = parse_script(coalesce_script(questions))
+    plain = plan_exam(exam, "nova", "nova", "onyx", response_format="pcm")
+    plan = plan_exam(exam, "nova", "nova", "onyx", response_format="pcm", coalesce=True)
+    for label, p, skip_ratio in (("one by one", plain, 0.0), ("coalesced", plan, 0.0),
+                                 ("coalesced, 10% unsplittable", plan, 0.1)):
+        client = PausingSpeechClient(skip_ratio=skip_ratio)
+        stats = {}
+        t0 = time.perf_counter()
+        clips = [data for _, data in synthesize_coalesced(client, p.requests, p.batches, workers, stats=stats,
+                                                          flight=None)]
+        elapsed = time.perf_counter() - t0
+        # 잘라 낸 문장은 원래 소리 길이(글자 수 x 40ms)에 앞뒤 무음이 조금 붙은 길이여야 한다
+        error = max(abs(len(data) / 48 - len(r.text) * 40) for r, data in zip(p.requests, clips))
+        print(f"coalesce  {label:28s} {len(p.requests)} sentences: {client.calls:3d} API calls "
+              f"(fallbacks {stats['fallbacks']}), {elapsed:.2f}s, max length error {error:.0f}ms")
+
+
+def bench_parallel(n=150, latency=0.05):
+    client = FakeSpeechClient(latency=latency)
+    requests = [SpeechRequest(DEFAULT_MODEL, "nova", f"Sentence {i}.", 1.0, None) for i in range(n)]
+    for workers in (1, 4, 8, 16):
+        _, stats = synthesize_all(client, requests, max_workers=workers)
+        print(f"parallel  workers={workers:2d}  {stats['elapsed']:.2f}s  x{stats['speedup']:.1f} vs serial")
+
+
+def bench_singleflight(sessions=8, n=40, latency=0.2):
+    # 여러 세션이 같은 모의고사를 동시에 생성할 때 실제 API 호출 수와 걸린 시간
+    requests = [SpeechRequest(DEFAULT_MODEL, "nova", f"Sentence {i}.", 1.0, None) for i in range(n)]
+    for label, flight in (("independent", None), ("single-flight", SingleFlight())):
+        client = FakeSpeechClient(latency=latency)
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=synthesize_all, args=(client, requests), kwargs={"flight": flight})
+                   for _ in range(sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"singleflight  {label:13s} {sessions} sessions x {n} sentences: "
+              f"{client.calls} API calls, {time.perf_counter() - t0:.2f}s")
+
+
+def fake_clip(seconds=3.0, frame_rate=24000):
+    # 디코딩된 OpenAI 음성과 같은 형식(24kHz, 모노, 16비트)의 임의 PCM
+    return AudioSegment(data=os.urandom(int(seconds * frame_rate) * 2),
+                        sample_width=2, frame_rate=frame_rate, channels=1)
+
+
+def exam_items(questions=50, lines_per_question=7, interline=700, internum=10000):
+    clip = fake_clip()
+    items = []
+    for q in range(questions):
+        if q:
+            items.append(internum)
+        for _ in range(lines_per_question):
+            items.append(clip)
+            items.append(interline)
+    return items
+
+
+def bench_assembly(questions=50):
+    items = exam_items(questions)
+
+    t0 = time.perf_counter()
+    tts = AudioSegment.silent(duration=0)
+    for item in items:
+        tts += item if isinstance(item, AudioSegment) else AudioSegment.silent(duration=item)
+    before = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    timeline = Timeline()
+    for item in items:
+        if isinstance(item, AudioSegment):
+            timeline.add_clip(item)
+        else:
+            timeline.add_silence(item)
+    rendered = timeline.render()
+    after = time.perf_counter() - t0
+
+    print(f"assembly  {questions} questions, {len(rendered) / 1000:.0f}s of audio: "
+          f"'+=' loop {before:.2f}s -> Timeline {after:.2f}s (x{before / after:.0f})")
+
+
+def bench_format(questions=50):
+    # 출력 형식이 같은 음성만 넣으면 조립 중 형식 변환이 한 번도 일어나지 않아야 한다
+    items = exam_items(questions)
+    calls = []
+    originals = {name: getattr(AudioSegment, name)
+                 for name in ("set_frame_rate", "set_channels", "set_sample_width")}
+
+    def counting(name):
+        def wrapper(self, value):
+            if getattr(self, name[4:]) != value:
+                calls.append(name)
+            return originals[name](self, value)
+        return wrapper
+
+    for name in originals:
+        setattr(AudioSegment, name, counting(name))
+    try:
+        timeline = Timeline(DEFAULT_FORMAT)
+        for item in items:
+            if isinstance(item, AudioSegment):
+                timeline.add_clip(item)
+            else:
+                timeline.add_silence(item)
+        rendered = timeline.render()
+    finally:
+        for name, original in originals.items():
+            setattr(AudioSegment, name, original)
+
+    assert timeline.conversions == 0 and not calls, calls
+    assert format_of(rendered) == DEFAULT_FORMAT
+    print(f"format    {questions} questions rendered at {DEFAULT_FORMAT}: 0 conversions")
+
+
+def bench_formats(clips=20, seconds=3.0):
+    # 전송 형식별로 (문장 하나의 용량, 디코딩 CPU 시간) 비교. mp3/opus 인코딩에 ffmpeg 필요
+    tone = Sine(220).to_audio_segment(duration=seconds * 1000).set_frame_rate(24000).set_channels(1).set_sample_width(2)
+    payloads = {"pcm": tone.raw_data}
+    for name, kwargs in (("wav", dict(format="wav")),
+                         ("mp3", dict(format="mp3")),
+                         ("opus", dict(format="ogg", codec="libopus"))):
+        buf = tone.export(BytesIO(), **kwargs)
+        payloads[name] = buf.getvalue()
+
+    for name, data in payloads.items():
+        t0 = time.process_time()
+        w0 = time.perf_counter()
+        for _ in range(clips):
+            decode_clip(data, DEFAULT_FORMAT, name)
+        cpu = (time.process_time() - t0) / clips * 1000
+        wall = (time.perf_counter() - w0) / clips * 1000
+        print(f"formats   {name:4s}  {len(data) / seconds / 1024:6.1f} KiB/s of speech  "
+              f"decode {wall:6.2f}ms wall / {cpu:5.2f}ms cpu per clip")
+
+
+def cpu_time():
+    # 이 프로세스와 끝난 자식 프로세스(ffmpeg)가 쓴 CPU 시간 합계(초)
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def bench_decoder(clips=200, sessions=4):
+    # mp3 문장 clips 개를 (문장마다 ffmpeg 프로세스) 와 (프로세스 안의 PyAV) 로 디코딩하는 시간 비교.
+    # sessions 개 스레드가 동시에 디코딩하는 경우(여러 세션이 함께 생성할 때)도 잰다. ffmpeg·PyAV 필요
+    rng = random.Random(0)
+    payloads = []
+    for n in range(clips):
+        tone = Sine(200 + n).to_audio_segment(duration=rng.uniform(1500, 4000))
+        tone = tone.set_frame_rate(24000).set_channels(1).set_sample_width(2)
+        payloads.append(tone.export(BytesIO(), format="mp3").getvalue())
+
+    for label, decode in (("subprocess", decode_with_ffmpeg), ("in-process", decode_with_av)):
+        for workers in (1, sessions):
+            chunks = [payloads[n::workers] for n in range(workers)]
+            durations = []
+            c0, w0 = cpu_time(), time.perf_counter()
+            threads = [threading.Thread(target=lambda chunk: durations.extend(
+                len(decode(data, DEFAULT_FORMAT, "mp3")) for data in chunk), args=(chunk,)) for chunk in chunks]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall, cpu = time.perf_counter() - w0, cpu_time() - c0
+            print(f"decoder   {label:10s} {clips} clips x{workers} threads: {wall:5.2f}s wall, "
+                  f"{cpu / clips * 1000:5.2f}ms cpu per clip, {sum(durations) / 1000:.0f}s of audio")
+
+
+def bench_streamdecode(clips=40, seconds=6.0, chunk_size=4096, chunk_delay=0.02):
+    # 문장마다 mp3 를 조금씩 받으면서 (다 받은 뒤 디코딩) 과 (받는 동안 디코딩) 의
+    # 마지막 바이트부터 쓸 수 있는 PCM 까지 걸리는 시간 비교. ffmpeg(인코딩)·PyAV 필요
+    tone = Sine(220).to_audio_segment(duration=seconds * 1000).set_frame_rate(24000).set_channels(1)
+    mp3 = tone.export(BytesIO(), format="mp3").getvalue()
+    client = FakeSpeechClient(latency=0.0, payload=mp3, chunk_size=chunk_size, chunk_delay=chunk_delay)
+    requests = [SpeechRequest(DEFAULT_MODEL, "nova", f"Sentence {i}.", 1.0, None, "mp3") for i in range(clips)]
+
+    t0 = time.perf_counter()
+    tail = 0.0
+    for request in requests:
+        data = fetch_speech(client, request)
+        t1 = time.perf_counter()
+        decode_clip(data, DEFAULT_FORMAT, "mp3")
+        tail += time.perf_counter() - t1
+    before = time.perf_counter() - t0
+
+    decoded = DecodedClips(DEFAULT_FORMAT)
+    t0 = time.perf_counter()
+    segments = [decoded.take(request_key(request), fetch_speech(client, request, decoded=decoded))
+                for request in requests]
+    after = time.perf_counter() - t0
+    reference = decode_clip(mp3, DEFAULT_FORMAT, "mp3")
+    assert all(isinstance(segment, AudioSegment) and len(segment.raw_data) == len(reference.raw_data)
+               for segment in segments)
+    print(f"streamdecode {clips} clips of {len(mp3) // 1024} KiB in {chunk_size // 1024} KiB chunks: "
+          f"last byte -> PCM {tail / clips * 1000:.2f}ms -> {decoded.finish_time / decoded.streamed * 1000:.2f}ms, "
+          f"total {before:.2f}s -> {after:.2f}s")
+
+
+def bench_regap(questions=20, lines_per_question=7):
+    # 간격만 바꿨을 때 다시 만드는 시간: (예전) 처음 바꿀 때 문장마다 ffmpeg 로 MP3 인코딩 vs
+    # (지금) 생성하는 동안 만들어 둔 문장별 MP3 를 프레임 잇기 / 그것이 없을 때 한 번에 인코딩. ffmpeg·PyAV 필요
+    pcm = fake_clip().raw_data
+    count = questions * lines_per_question
+    keys = [f"{n:064x}" for n in range(count)]
+    timeline = []
+    for q in range(questions):
+        if q:
+            timeline.append(("internum", q))
+        for n in range(lines_per_question):
+            timeline.append(("speech", q * lines_per_question + n))
+            timeline.append(("interline", None))
+    with tempfile.TemporaryDirectory() as root:
+        cache = ClipCache(root)
+        for key in keys:
+            cache.put(key, pcm)
+        path = Path(root) / "exam.mp3"
+
+        t0 = time.perf_counter()
+        mp3_clips = [AudioSegment(data=pcm, sample_width=2, frame_rate=24000, channels=1)
+                     .export(BytesIO(), format="mp3").getvalue() for _ in keys]
+        assemble_exam(timeline, mp3_clips, Mp3Splicer(), "mp3", 900).render()
+        before = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        assert rebuild_exam(timeline, keys, "pcm", cache, path, 900) == "encode"
+        fallback = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for key in keys:
+            cache_clip_mp3(cache, key, pcm, "pcm")
+        prebuild = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        assert rebuild_exam(timeline, keys, "pcm", cache, path, 1200) == "splice"
+        after = time.perf_counter() - t0
+    print(f"regap     {count} clips: per-clip ffmpeg encode {before:.2f}s -> splice prebuilt {after * 1000:.0f}ms "
+          f"(prebuilt during generation in {prebuild:.2f}s; without them one encode {fallback:.2f}s)")
+
+
+def bench_splice(questions=50):
+    # 같은 시험을 (디코딩 + Timeline + MP3 인코딩) 과 (MP3 프레임 잇기) 로 만드는 시간 비교
+    tone = Sine(220).to_audio_segment(duration=3000).set_frame_rate(24000).set_channels(1)
+    mp3 = tone.export(BytesIO(), format="mp3").getvalue()
+    items = [mp3 if isinstance(item, AudioSegment) else item for item in exam_items(questions)]
+
+    t0 = time.perf_counter()
+    timeline = Timeline(DEFAULT_FORMAT)
+    for item in items:
+        if isinstance(item, bytes):
+            timeline.add_clip(decode_clip(item, DEFAULT_FORMAT, "mp3"))
+        else:
+            timeline.add_silence(item)
+    timeline.render().export(BytesIO(), format="mp3")
+    before = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    splicer = Mp3Splicer()
+    for item in items:
+        if isinstance(item, bytes):
+            splicer.add_clip(item)
+        else:
+            splicer.add_silence(item)
+    splicer.render()
+    after = time.perf_counter() - t0
+    print(f"splice    {questions} questions: decode+encode {before:.2f}s -> frame splice {after * 1000:.0f}ms")
+
+
+def bench_streaming(questions=25, internum=25000):
+    # 전체를 모아서 인코딩할 때와 스트리밍으로 인코딩할 때의 최대 메모리 비교 (ffmpeg 필요)
+    pcm = fake_clip().raw_data
+    results = {}
+    for name in ("Timeline", "StreamingEncoder"):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "speech.mp3")
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            assembler = Timeline(DEFAULT_FORMAT) if name == "Timeline" else StreamingEncoder(path, DEFAULT_FORMAT)
+            for q in range(questions):
+                if q:
+                    assembler.add_silence(internum)
+                for _ in range(7):
+                    assembler.add_pcm(pcm)
+                    assembler.add_silence(700)
+            if name == "Timeline":
+                assembler.render().export(path, format="mp3")
+            else:
+                assembler.close()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[name] = (peak, time.perf_counter() - t0)
+    for name, (peak, elapsed) in results.items():
+        print(f"streaming {questions} questions, internum {internum / 1000:.0f}s: {name:16s} peak {peak / 2 ** 20:7.1f} MiB  {elapsed:.2f}s")
+
+
+def legacy_parse(text):
+    # 기존 streamlit_app.py 의 merge_lines + extract_* 처리 (비교용 사본)
+    def which_eng_kor(input_s):
+        from collections import Counter
+        count = Counter(input_s)
+        k_count = sum(count[c] for c in count if ord('가') <= ord(c) <= ord('힣'))
+        e_count = sum(count[c] for c in count if 'a' <= c.lower() <= 'z')
+        return "ko" if k_count > e_count else "en"
+
+    merged = []
+    current_sentence = ""
+    for line in text.split('\n'):
+        line = line.strip()
+        current_sentence += " " + line
+        if line.endswith('.') or line.endswith('?') or line.endswith('!'):
+            merged.append(current_sentence.strip())
+            current_sentence = ""
+    if current_sentence:
+        merged.append(current_sentence.strip())
+
+    out = []
+    for sentence in merged:
+        sentence = sentence.lstrip()
+        lang = which_eng_kor(sentence)
+        tone = None
+        m = re.match(r'^\s*\[([^\]]+)\]\s*(.*)', sentence)
+        if m:
+            tone, sentence = m.group(1).strip(), m.group(2)
+        speaker = None
+        m = re.match(r'^\s*M\s*:?\s*(.*)', sentence)
+        if m:
+            speaker, sentence = "male", m.group(1).strip()
+        else:
+            m = re.match(r'^\s*W\s*:?\s*(.*)', sentence)
+            if m:
+                speaker, sentence = "female", m.group(1).strip()
+        number = None
+        m = re.match(r'^\s*(\d+)\s*\.?\s*번?\s*(.*)', sentence)
+        if m:
+            number, sentence = m.group(1).strip(), m.group(2).strip()
+        else:
+            sentence = sentence.lstrip()
+        out.append((sentence, speaker, tone, lang, number))
+    return out
+
+
+def fake_script(lines=10000, seed=0):
+    rng = random.Random(seed)
+    out = []
+    q = 1
+    while len(out) < lines:
+        out.append(f"{q}번 다음 대화를 듣고, 여자의 의견으로 가장 적절한 것을 고르시오.")
+        for _ in range(rng.randint(4, 12)):
+            speaker = rng.choice(["M:", "W:", "[Curious] M:", "[Soft whisper] W:"])
+            out.append(f"{speaker} Could you keep the orange peels for me, sweetie")
+            out.append("I am planning to use them to make a natural cleaner.")
+        out.append("")
+        q += 1
+    return "\n".join(out[:lines])
+
+
+def bench_parser(lines=10000):
+    text = fake_script(lines)
+    t0 = time.perf_counter()
+    before = legacy_parse(text)
+    legacy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    exam = parse_script(text)
+    after = time.perf_counter() - t0
+    parsed = [(u.text, u.speaker, u.tone, u.language, u.number) for u in exam.utterances()]
+    assert parsed == before
+    print(f"parser    {lines} lines, {len(parsed)} utterances, {len(exam.questions)} questions: "
+          f"legacy {legacy * 1000:.0f}ms -> parse_script {after * 1000:.0f}ms")
+
+
+def bench_ratelimit(n=120, rps=30, cps=600):
+    # 초당 rps 요청·cps 글자를 넘으면 429 를 주는 로컬 서버에 대해, 제한기 없이/있이 같은 작업을 보낸다
+    requests = [SpeechRequest(DEFAULT_MODEL, "nova", f"Rate limited sentence {i:03d}.", 1.0, None, "pcm")
+                for i in range(n)]
+    for label, limiter in (("no limiter", None), ("token bucket", RateLimiter(rps, cps, period=1.0))):
+        with running_server(rpm=rps, cpm=cps, period=1.0, latency=0.05) as server:
+            client = LocalSpeechClient(f"http://127.0.0.1:{server.server_address[1]}/v1")
+            t0 = time.perf_counter()
+            try:
+                synthesize_all(client, requests, max_workers=8, flight=None, limiter=limiter)
+                result = "completed"
+            except Exception as e:
+                result = f"failed ({e})"
+            print(f"ratelimit  {label:12s} {result}, {time.perf_counter() - t0:.2f}s, "
+                  f"server accepted {server.limits.accepted} / rejected {server.limits.rejected}"
+                  + (f", queued {limiter.waited:.1f}s" if limiter else ""))
+
+
+def bench_adaptive(n=200, capacity=6, latency=0.1):
+    # 동시에 capacity 개까지만 처리하고 넘치면 503 을 주는 서버에 고정 동시 요청 수와 AIMD 를 비교
+    requests = [SpeechRequest(DEFAULT_MODEL, "nova", f"Adaptive sentence {i:03d}.", 1.0, None, "pcm")
+                for i in range(n)]
+    cases = [("fixed 2", 2, None), ("fixed 16", 16, AdaptiveConcurrency(16, 16, 16)),
+             ("AIMD", 16, AdaptiveConcurrency(initial=2, max_limit=16))]
+    for label, workers, controller in cases:
+        with running_server(capacity=capacity, latency=latency) as server:
+            client = LocalSpeechClient(f"http://127.0.0.1:{server.server_address[1]}/v1")
+            t0 = time.perf_counter()
+            try:
+                synthesize_all(client, requests, max_workers=workers, flight=None, controller=controller)
+                result = "completed"
+            except Exception as e:
+                result = f"failed ({e})"
+            line = (f"adaptive  {label:8s} {result}, {time.perf_counter() - t0:.2f}s, "
+                    f"503 responses {server.overloaded}")
+            if controller is not None:
+                snapshot = controller.snapshot()
+                line += (f", final limit {snapshot['limit']} "
+                         f"(+{snapshot['increases']} / -{snapshot['decreases']})")
+            print(line)
+
+
+def bench_fairness(big=400, small=2, rps=100, workers=8, latency=0.05):
+    # 큰 시험을 만드는 중에 다른 세션이 두 문장을 미리 들을 때, 작은 작업이 끝나기까지 걸리는 시간
+    # (모든 세션이 초당 rps 요청 제한기를 나눠 쓴다)
+    big_requests = [SpeechRequest(DEFAULT_MODEL, "nova", f"Big exam sentence {i}.", 1.0, None) for i in range(big)]
+    small_requests = [SpeechRequest(DEFAULT_MODEL, "echo", f"Preview sentence {i}.", 1.0, None) for i in range(small)]
+    for label, scheduler in (("per-job pools", None), ("fair scheduler", FairScheduler(workers=workers))):
+        client = FakeSpeechClient(latency=latency)
+        limiter = RateLimiter(rps, 10 ** 9, period=1.0)
+        limiter.requests.tokens = 0     # 처음부터 한도가 꽉 찬 상태
+        times = {}
+
+        def job(name, requests, job_workers):
+            t0 = time.perf_counter()
+            synthesize_all(client, requests, max_workers=job_workers, flight=None, limiter=limiter,
+                           scheduler=scheduler, tenant=name)
+            times[name] = time.perf_counter() - t0
+
+        big_thread = threading.Thread(target=job, args=("big", big_requests, 16))
+        big_thread.start()
+        time.sleep(0.5)
+        job("small", small_requests, 16)
+        big_thread.join()
+        line = f"fairness  {label:14s} small job {times['small'] * 1000:.0f}ms, big job {times['big']:.2f}s"
+        if scheduler is not None:
+            waits = scheduler.snapshot()
+            line += f", avg wait big {waits['big']['avg_wait_ms']}ms / small {waits['small']['avg_wait_ms']}ms"
+        print(line)
+
+
+def bench_priority(exams=4, big=100, preview=5, workers=16, latency=0.2, max_concurrency=4, requests_per_sec=15):
+    # 여러 세션이 전체 시험을 만드는 동안 한 문제(preview 문장)를 미리 들을 때 걸리는 시간.
+    # 모든 요청이 같은 스케줄러·동시 요청 조절기(max_concurrency)·제한기(초당 requests_per_sec)를 지난다
+    for label, priority in (("fair queue", False), ("priority lane", True)):
+        client = FakeSpeechClient(latency=latency)
+        scheduler = FairScheduler(workers=workers)
+        controller = AdaptiveConcurrency(initial=max_concurrency, max_limit=max_concurrency)
+        limiter = RateLimiter(requests_per_sec, requests_per_sec * 1000, period=1.0)
+        shared = {"flight": None, "scheduler": scheduler, "controller": controller, "limiter": limiter}
+        threads = []
+        for n in range(exams):
+            requests = [SpeechRequest(DEFAULT_MODEL, "nova", f"Exam {n} sentence {i}.", 1.0, None) for i in range(big)]
+            threads.append(threading.Thread(target=synthesize_all, args=(client, requests, 16),
+                                            kwargs=dict(shared, tenant=f"exam{n}")))
+        for thread in threads:
+            thread.start()
+        time.sleep(1.0)
+        requests = [SpeechRequest(DEFAULT_MODEL, "echo", f"Preview sentence {i}.", 1.0, None) for i in range(preview)]
+        t0 = time.perf_counter()
+        synthesize_all(client, requests, preview, tenant="preview", priority=priority, **shared)
+        print(f"priority  {label:13s} {preview}-sentence preview during {exams} exams: "
+              f"{(time.perf_counter() - t0) * 1000:.0f}ms (one round trip = {latency * 1000:.0f}ms, "
+              f"{max_concurrency} in flight, {requests_per_sec} req/s)")
+        for thread in threads:
+            thread.join()
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def bench_tail(jobs=30, n=40, slow_ratio=0.02, slow_latency=2.0, error_ratio=0.02):
+    # 가끔 아주 늦거나(slow_ratio) 500 을 주는(error_ratio) 서버에서 작업 완료 시간의 p50/p99
+    cases = (("no retry", 0, None), ("retry", tts_engine.MAX_RETRIES, None),
+             ("retry+hedge", tts_engine.MAX_RETRIES, HedgePolicy(budget=0.1)))
+    for label, retries, hedger in cases:
+        saved, tts_engine.MAX_RETRIES = tts_engine.MAX_RETRIES, retries
+        with running_server(latency=0.05, slow_ratio=slow_ratio, slow_latency=slow_latency,
+                            error_ratio=error_ratio, seed=1) as server:
+            client = LocalSpeechClient(f"http://127.0.0.1:{server.server_address[1]}/v1")
+            times, failed = [], 0
+            for job in range(jobs):
+                requests = [SpeechRequest(DEFAULT_MODEL, "nova", f"Job {job} sentence {i}.", 1.0, None, "pcm")
+                            for i in range(n)]
+                t0 = time.perf_counter()
+                try:
+                    synthesize_all(client, requests, max_workers=8, flight=None, hedger=hedger)
+                    times.append(time.perf_counter() - t0)
+                except Exception:
+                    failed += 1
+        tts_engine.MAX_RETRIES = saved
+        line = f"tail  {label:11s} failed jobs {failed}/{jobs}"
+        if times:
+            line += f", p50 {percentile(times, 0.5):.2f}s, p99 {percentile(times, 0.99):.2f}s"
+        if hedger is not None:
+            line += f", hedges {hedger.hedges} (won {hedger.hedge_wins})"
+        print(line)
+
+
+BENCHMARKS = {
+    "parallel": bench_parallel,
+    "assembly": bench_assembly,
+    "format": bench_format,
+    "formats": bench_formats,
+    "splice": bench_splice,
+    "streaming": bench_streaming,
+    "parser": bench_parser,
+    "singleflight": bench_singleflight,
+    "ratelimit": bench_ratelimit,
+    "adaptive": bench_adaptive,
+    "fairness": bench_fairness,
+    "priority": bench_priority,
+    "tail": bench_tail,
+    "decoder": bench_decoder,
+    "streamdecode": bench_streamdecode,
+    "coalesce": bench_coalesce,
+    "segment": bench_segment,
+    "dedup": bench_dedup,
+    "regap": bench_regap,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
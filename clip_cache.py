@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import unicodedata
+from pathlib import Path
+
+# 여러 Streamlit 프로세스가 같은 폴더를 함께 쓸 수 있도록
+# 파일은 임시 파일에 쓴 뒤 os.replace 로 한 번에 바꿔치기(원자적 쓰기)한다.
+DEFAULT_CACHE_DIR = os.getenv("TTS_CACHE_DIR", ".tts_cache")
+DEFAULT_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def normalize_text(text):
+    # 공백·유니코드 표기 차이만 있는 문장은 같은 음성으로 취급
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def clip_key(model, voice, text, speed, instructions, response_format="mp3"):
+    payload = json.dumps(
+        [model, voice, normalize_text(text), speed, instructions or "", response_format],
+        ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def derived_key(key, tag):
+    # 같은 음성을 다른 형태로 바꾼 결과(예: MP3 인코딩)를 저장할 키
+    return hashlib.sha256(f"{key}:{tag}".encode("utf-8")).hexdigest()
+
+
+class ClipCache:
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._written = 0          # 마지막 정리 이후 새로 쓴 바이트
+        self._lock = threading.Lock()
+        self.evict()
+
+    def _path(self, key):
+        # 한 폴더에 파일이 몰리지 않도록 ab/cd/abcd... 로 나눠 저장
+        return self.root / key[:2] / key[2:4] / key
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            os.utime(path)         # 최근 사용 시각 갱신 (LRU)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def contains(self, key):
+        # 읽지 않고 있는지만 본다 (적중·실패 횟수에 넣지 않음)
+        return self._path(key).exists()
+
+    def put(self, key, data):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_name, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except FileNotFoundError:
+                pass
+            raise
+        with self._lock:
+            self._written += len(data)
+            need_evict = self._written > self.max_bytes // 10
+        if need_evict:
+            self.evict()
+
+    def evict(self):
+        # 용량을 넘으면 가장 오래 쓰지 않은 파일부터 지워 90% 까지 줄인다
+        with self._lock:
+            self._written = 0
+        entries = []
+        total = 0
+        for path in self.root.glob("*/*/*"):
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                info = path.stat()
+            except FileNotFoundError:
+                continue   # 다른 프로세스가 먼저 지운 경우
+            entries.append((info.st_mtime, info.st_size, path))
+            total += info.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_default_cache():
+    # 프로세스 안의 모든 세션이 같은 캐시 객체를 쓴다
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ClipCache()
+        return _default_cache
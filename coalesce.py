@@ -0,0 +1,94 @@
+from audio_assembly import PCM_FORMAT, pcm_to_wav, split_at_pauses
+from clip_cache import derived_key
+from tts_engine import synthesize_iter, synthesize_all, request_key, DEFAULT_WORKERS
+
+# 계획의 묶음(plan.batches)마다 API 를 한 번만 부르고, 받은 음성을 문장 사이 무음에서 다시 잘라
+# 문장별로 내보낸다. 문제마다 "Number One." 과 보기 다섯 줄처럼 같은 목소리로 이어지는 짧은 문장들이
+# 요청 하나로 줄어든다. 잘라 낸 문장은 타임라인에서 원래대로 문장 사이 간격(interline)을 받는다.
+# - 묶음 요청은 문장 사이에 PAUSE_MARKER 를 넣고 pcm 으로 받는다
+# - 잘라 낸 문장은 묶음 요청 키에서 만든 키(part_key)로 캐시에 넣어, 간격만 바꿀 때 그대로 쓴다.
+#   문장별로 받은 음성(request_key)과는 섞지 않는다: 잘못 자른 조각이 묶지 않은 생성이나 미리 듣기로 새지 않게
+# - 무음 수가 문장 수와 맞지 않으면 그 묶음만 문장별로 다시 요청한다
+PAUSE_MARKER = "\n\n...\n\n"
+
+
+def batch_request(requests):
+    # 묶음의 요청들은 문장만 다르다 (planner.group_batches)
+    return requests[0]._replace(text=PAUSE_MARKER.join(r.text for r in requests), response_format="pcm")
+
+
+def part_key(request, batch):
+    # batch(묶음의 요청들)를 한 번에 받아 잘라 낸 request 문장의 캐시 키
+    return derived_key(request_key(request), "coalesced:" + request_key(batch_request(batch)))
+
+
+def batch_clip_keys(requests, batches):
+    # 요청 번호마다 synthesize_coalesced() 가 그 음성을 캐시에 넣는 키
+    keys = [request_key(r) for r in requests]
+    for batch in batches:
+        if len(batch) > 1:
+            members = [requests[i] for i in batch]
+            for i in batch:
+                keys[i] = part_key(requests[i], members)
+    return keys
+
+
+def encode_part(pcm, response_format):
+    return pcm if response_format == "pcm" else pcm_to_wav(pcm, PCM_FORMAT)
+
+
+def synthesize_coalesced(client, requests, batches, max_workers=DEFAULT_WORKERS, on_done=None, cache=None,
+                         stats=None, **options):
+    # synthesize_iter 와 같이 (요청 번호, 바이트) 를 요청 순서대로 내보낸다.
+    # options 는 synthesize_iter 에 그대로 넘긴다 (flight, limiter, controller, scheduler, tenant, cancel ...)
+    calls = [batch_request([requests[i] for i in batch]) if len(batch) > 1 else requests[batch[0]]
+             for batch in batches]
+    call_stats = {}
+    fallbacks = 0
+    retried = 0         # 자르지 못해 문장별로 다시 보낸 요청 수
+    failed = set()      # 자르지 못한 묶음 번호
+    retry_hits = retry_shared = 0
+    done = 0
+    clip_iter = synthesize_iter(client, calls, max_workers, None, cache, call_stats, **options)
+    try:
+        for n, data in clip_iter:
+            batch = batches[n]
+            parts = split_at_pauses(data, len(batch)) if len(batch) > 1 else [data]
+            if parts is None:
+                fallbacks += 1
+                retried += len(batch)
+                print(f"Could not split {len(batch)} coalesced sentences at pauses, requesting them one by one")
+                failed.add(n)
+                parts, retry_stats = synthesize_all(client, [requests[i] for i in batch], max_workers, cache=cache,
+                                                    **options)
+                retry_hits += retry_stats["cache_hits"]
+                retry_shared += retry_stats["shared"]
+            elif len(batch) > 1:
+                parts = [encode_part(part, requests[i].response_format) for i, part in zip(batch, parts)]
+            if len(batch) > 1 and cache is not None:
+                # 다시 요청한 문장도 같은 키로 넣어 두어, batch_clip_keys() 로 모두 찾을 수 있게 한다
+                members = [requests[i] for i in batch]
+                for i, part in zip(batch, parts):
+                    cache.put(part_key(requests[i], members), part)
+            for i, part in zip(batch, parts):
+                done += 1
+                if on_done:
+                    on_done(done, len(requests))
+                yield i, part
+    finally:
+        clip_iter.close()
+
+    if stats is None:
+        stats = {}
+    stats.update(call_stats)
+    # synthesize_iter 의 cache_hits·shared 는 묶음 요청 수이므로 문장 수로 바꾼다
+    # (자르지 못한 묶음은 문장별로 다시 보낸 결과로 센다)
+    sentences = lambda indices: sum(len(batches[n]) for n in indices if n not in failed)
+    stats.update({
+        "cache_hits": sentences(call_stats.get("cache_hit_indices", ())) + retry_hits,
+        "shared": sentences(call_stats.get("shared_indices", ())) + retry_shared,
+        "requests": len(requests),
+        "calls": len(calls) + retried,    # 보낸 요청 수 (캐시에서 가져온 것 포함)
+        "saved_calls": len(requests) - len(calls) - retried,
+        "fallbacks": fallbacks,
+    })
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from collections import deque
+
+from jobs import JobCancelled
+
+# 동시에 보내는 TTS 요청 수를 스스로 조절한다 (AIMD: 덧셈으로 늘리고 곱셈으로 줄인다).
+# - 429/5xx·연결 오류를 받으면 절반으로 줄인다
+# - 첫 바이트까지 걸리는 시간이 평소의 2배를 넘으면 조금(0.9배) 줄인다
+# - 정상 응답이면 한 바퀴(현재 한도만큼의 응답)마다 1씩 늘려 본다
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("TTS_MAX_CONCURRENCY", 32))
+DEFAULT_INITIAL_CONCURRENCY = int(os.getenv("TTS_INITIAL_CONCURRENCY", 4))
+ERROR_DECREASE = 0.5
+LATENCY_DECREASE = 0.9
+LATENCY_TOLERANCE = 2.0         # 평소 지연의 몇 배부터 '지연이 늘었다'고 볼지
+EWMA_ALPHA = 0.2
+PRIORITY_RESERVE = 2            # 우선 요청(한 문제 미리 듣기)만 한도를 넘어 더 쓸 수 있는 자리 (scheduler 의 우선 작업자 수)
+
+
+class AdaptiveConcurrency:
+    def __init__(self, initial=DEFAULT_INITIAL_CONCURRENCY, min_limit=DEFAULT_MIN_CONCURRENCY,
+                 max_limit=DEFAULT_MAX_CONCURRENCY):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.in_flight = 0
+        self.latency = None         # 첫 바이트까지 걸린 시간의 지수 이동 평균(초)
+        self.baseline = None        # 한가할 때의 지연(관측한 가장 짧은 값에서 천천히 따라 올라감)
+        self.increases = 0
+        self.decreases = 0
+        self.decisions = deque(maxlen=50)   # (시각, "increase"/"decrease", 새 한도, 이유)
+        self._last_decrease = 0.0
+        self._priority_waiting = 0      # 자리를 기다리는 우선 요청 수. 0 이 아니면 일반 요청은 빈 자리를 가져가지 않는다
+        self._cond = threading.Condition()
+
+    def acquire(self, cancel=None, priority=False):
+        # 현재 한도보다 많이 보내고 있으면 자리가 날 때까지 기다린다 (cancel 이 멈추면 JobCancelled)
+        # priority=True 면 한도 위로 PRIORITY_RESERVE 자리를 더 쓸 수 있어, 전체 시험 요청이 자리를 다 차지해도 바로 나가고,
+        # 그래도 기다리게 되면 다음 빈 자리를 일반 요청보다 먼저 가져간다
+        with self._cond:
+            if priority:
+                self._priority_waiting += 1
+            try:
+                while (self.in_flight >= int(self.limit) + (PRIORITY_RESERVE if priority else 0)
+                       or (not priority and self._priority_waiting)):
+                    if cancel is not None:
+                        cancel.check()
+                    self._cond.wait(0.1 if cancel is not None else None)
+                self.in_flight += 1
+            finally:
+                if priority:
+                    self._priority_waiting -= 1
+                    self._cond.notify_all()
+
+    def release(self, latency=None, error=None):
+        # latency: 첫 바이트까지 걸린 시간, error: 실패했을 때의 예외
+        with self._cond:
+            self.in_flight -= 1
+            if error is not None and not isinstance(error, JobCancelled):
+                status = getattr(error, "status_code", None)
+                if status is None or status == 429 or status >= 500:
+                    self._decrease(ERROR_DECREASE, f"HTTP {status}" if status else type(error).__name__)
+            elif latency is not None:
+                self._observe(latency)
+            self._cond.notify_all()
+
+    def _observe(self, latency):
+        self.latency = latency if self.latency is None else self.latency + EWMA_ALPHA * (latency - self.latency)
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline += (self.latency - self.baseline) * 0.01
+        if self.latency > self.baseline * LATENCY_TOLERANCE:
+            self._decrease(LATENCY_DECREASE, f"latency {self.latency * 1000:.0f}ms > {LATENCY_TOLERANCE:g}x "
+                                             f"{self.baseline * 1000:.0f}ms")
+        elif self.limit < self.max_limit:
+            before = int(self.limit)
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            if int(self.limit) > before:
+                self.increases += 1
+                self.decisions.append((time.time(), "increase", int(self.limit), "healthy"))
+
+    def _decrease(self, factor, reason):
+        # 같은 혼잡으로 여러 응답이 한꺼번에 실패해도 한 번만 줄이도록, 평소 지연만큼은 다시 줄이지 않는다
+        now = time.monotonic()
+        if now - self._last_decrease < max(0.1, self.latency or 0.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.decreases += 1
+        self.decisions.append((time.time(), "decrease", int(self.limit), reason))
+
+    def snapshot(self):
+        # 화면·로그에 보여 줄 현재 상태
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "latency_ms": round(self.latency * 1000) if self.latency is not None else None,
+                "baseline_ms": round(self.baseline * 1000) if self.baseline is not None else None,
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "decisions": [{"시각": time.strftime("%H:%M:%S", time.localtime(t)), "조절": action,
+                               "한도": limit, "이유": reason}
+                              for t, action, limit, reason in self.decisions],
+            }
+
+
+_default_controller = None
+_default_lock = threading.Lock()
+
+
+def get_default_controller():
+    # 프로세스 안의 모든 세션이 같은 한도를 나눠 쓴다 (API 한도는 계정 단위이므로)
+    global _default_controller
+    with _default_lock:
+        if _default_controller is None:
+            _default_controller = AdaptiveConcurrency()
+        return _default_controller
@@ -7,6 +7,8 @@ from gtts import gTTS
 from collections import Counter
 import re
 import wave
+from io import BytesIO
+from job_store import get_default_store
 
 def which_eng_kor(input_s):
     count = Counter(input_s)
@@ -104,33 +106,36 @@ else:
             col_line.markdown(talk.strip())
 
     if col_buttons.button("Convert to Speech"):
+        # 세션마다 따로 쓰는 임시 파일에 쓰고, 다 쓰면 공개
+        store = get_default_store()
+        final_output = store.new_temp_path(".wav")
         try:
-            final_output = "final_speech.wav"
-            with wave.open(final_output, 'wb') as final_wf:
+            with wave.open(str(final_output), 'wb') as final_wf:
                 for line in st.session_state.input_text.split("\n"):
                     if line.strip() == "":
                         continue
 
+                    # 임시 파일 대신 메모리 버퍼 사용 (다른 세션과 겹치지 않음)
+                    temp_file = BytesIO()
                     if which_eng_kor(line) == "ko":
                         tts = gTTS(line, lang='ko')
-                        temp_file = f"temp.wav"
-                        tts.save(temp_file)
+                        tts.write_to_fp(temp_file)
                     else:
                         response = client.audio.speech.create(
                             model="tts-1-hd",
                             voice=option,
                             input=line
                         )
-                        temp_file = f"temp.wav"
-                        with open(temp_file, 'wb') as audio_file:
-                            for chunk in response.iter_bytes():
-                                audio_file.write(chunk)
-                    
+                        for chunk in response.iter_bytes():
+                            temp_file.write(chunk)
+                    temp_file.seek(0)
+
                     append_audio_file(final_wf, temp_file)
-                    os.remove(temp_file)
 
+            published = store.publish(final_output)
             st.success("Speech conversion successful!")
-            st.audio(final_output)
+            st.audio(str(published))
 
         except Exception as e:
+            store.discard(final_output)
             st.error(f"An error occurred: {e}")
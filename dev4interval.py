@@ -1,5 +1,4 @@
 import streamlit as st
-from pathlib import Path
 from openai import OpenAI
 import os
 from dotenv import load_dotenv
@@ -8,6 +7,11 @@ import re
 import random
 from pydub import AudioSegment
 from io import BytesIO
+from tts_engine import SpeechRequest, fetch_speech_cached
+from clip_cache import get_default_cache
+from rate_limit import get_default_limiter
+from job_store import get_default_store
+from audio_assembly import silence
 
 # CSS 스타일 추가
 st.markdown(
@@ -114,8 +118,9 @@ else:
     internum = col_interval.slider("문제 간격(s)", min_value=1, max_value=15, value=10, key="internum", disabled=False, help="문제와 문제 사이의 무음 구간 길이")
 
     # 무음을 미리 생성
-    interline_silence = AudioSegment.silent(duration=interline)
-    internum_silence = AudioSegment.silent(duration=internum * 1000)
+    # 음성과 같은 형식(24kHz)으로 만들어 이어 붙일 때 재샘플링이 일어나지 않게 함
+    interline_silence = silence(interline)
+    internum_silence = silence(internum * 1000)
 
     if 'female_sequence' not in st.session_state:
         st.session_state.female_sequence = 0
@@ -177,7 +182,6 @@ Orange peels are great for cleaning surfaces."""
                     <span class="fa fa-spinner fa-spin fa-3x"></span>
                 </div><div style="color: white;">음원을 출력하는 중...</div></div></div>""", unsafe_allow_html=True)
         try:
-            speech_file_path = Path("speech.mp3")
             input_text = st.session_state.input_text
             lines = input_text.split('\n')
             sentences = merge_lines(lines)
@@ -221,21 +225,29 @@ Orange peels are great for cleaning surfaces."""
                 text_to_convert = f"{number[:-1]}번.\n'.....'\n {sentence}" if number else sentence
 
                 if text_to_convert.strip():
-                    response = client.audio.speech.create(
+                    # 캐시에 없을 때만 API 를 호출합니다.
+                    data, _ = fetch_speech_cached(client, SpeechRequest(
                         model="tts-1",
                         voice=current_voice,
-                        input=text_to_convert,
-                        speed=speed_rate
-                    )
-
-                    # response.iter_bytes()를 통해 생성된 바이트 데이터를 읽어옵니다.
-                    audio_bytes = BytesIO(b"".join(response.iter_bytes()))
+                        text=text_to_convert,
+                        speed=speed_rate,
+                        instructions=None
+                    ), get_default_cache(), limiter=get_default_limiter())
+                    audio_bytes = BytesIO(data)
                     audio_chunk = AudioSegment.from_file(audio_bytes, format="mp3")
                     tts += audio_chunk
 
                     tts += interline_silence  # 문장 간 무음 추가
 
-            tts.export(speech_file_path, format="mp3")
+            # 작업마다 따로 쓰는 임시 파일에 쓴 뒤 원자적으로 공개 (다른 세션의 음원을 덮어쓰지 않음)
+            store = get_default_store()
+            temp_path = store.new_temp_path(".mp3")
+            try:
+                tts.export(temp_path, format="mp3")
+                speech_file_path = store.publish(temp_path)
+            except BaseException:
+                store.discard(temp_path)
+                raise
             st.session_state.speech_file_path = str(speech_file_path)
             st.session_state.success_message = "Speech conversion successful!"
             st.session_state.en_warning_message = "고지 사항: 이 목소리는 인공지능(AI)으로 생성된 것이며, 실제 사람의 목소리가 아닙니다."
@@ -247,6 +259,10 @@ Orange peels are great for cleaning surfaces."""
         overlay_container.empty()
         st.balloons()
 
+    # 오래되어 정리된 파일이면 다시 생성하도록 안내
+    if 'speech_file_path' in st.session_state and not os.path.exists(st.session_state.speech_file_path):
+        del st.session_state.speech_file_path
+
     if 'speech_file_path' in st.session_state:
         success_message.success(st.session_state.success_message)
         warning_message.warning(st.session_state.en_warning_message, icon="🚨")
@@ -0,0 +1,215 @@
+# OpenAI 음성 합성 API(POST /v1/audio/speech)를 흉내 내는 로컬 서버 (API 키·요금 없이 시험용)
+# - 분당 요청 수·글자 수 한도를 넘으면 실제 API 처럼 429 와 Retry-After 를 돌려준다
+# - 동시에 처리 중인 요청이 capacity 를 넘으면 503(과부하)을 돌려준다
+# - slow_ratio 비율의 요청은 slow_latency 만큼 늦게, error_ratio 비율의 요청은 500 으로 응답한다
+# - 무음 pcm/wav/mp3 를 글자 수에 비례한 길이로 돌려준다
+# 사용법: python fake_tts_server.py --port 8089 --rpm 60 --cpm 5000
+#         OPENAI_BASE_URL=http://127.0.0.1:8089/v1 streamlit run streamlit_app.py
+import argparse
+import io
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import wave
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mp3_splice import silent_frame
+from rate_limit import TokenBucket
+
+SAMPLE_RATE = 24000
+SECONDS_PER_CHAR = 0.06
+_MP3_HEADER = b"\xff\xf3\x44\xc0"       # MPEG-2 Layer III, 32kbps, 24kHz, 모노
+
+
+def fake_audio(text, response_format):
+    samples = int(len(text) * SECONDS_PER_CHAR * SAMPLE_RATE)
+    if response_format == "pcm":
+        return b"\0" * (samples * 2)
+    if response_format == "wav":
+        out = io.BytesIO()
+        with wave.open(out, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            w.writeframes(b"\0" * (samples * 2))
+        return out.getvalue()
+    if response_format == "mp3":
+        return silent_frame(_MP3_HEADER) * max(1, samples // 576)
+    return None
+
+
+class Limits:
+    # 실제 API 처럼 한도가 조금씩 계속 채워지는 방식(토큰 버킷)으로 요청 수·글자 수를 센다
+    def __init__(self, rpm=None, cpm=None, period=60.0):
+        self.requests = TokenBucket(rpm, period) if rpm else None
+        self.chars = TokenBucket(cpm, period) if cpm else None
+        self.accepted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def admit(self, chars):
+        # 받아들이면 None, 한도를 넘으면 다시 보낼 때까지 기다릴 초를 돌려준다
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(1, now) if self.requests else 0.0,
+                       self.chars.wait_time(chars, now) if self.chars else 0.0)
+            if wait > 0:
+                self.rejected += 1
+                return wait
+            if self.requests:
+                self.requests.take(1)
+            if self.chars:
+                self.chars.take(chars)
+            self.accepted += 1
+            return None
+
+
+class FakeSpeechHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, headers=None):
+        self._send(status, json.dumps({"error": {"message": message, "type": "fake_server"}}).encode(),
+                   headers=headers)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/audio/speech"):
+            self._error(404, "not found")
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        text = body.get("input", "")
+        retry_after = self.server.limits.admit(len(text))
+        if retry_after is not None:
+            self._error(429, "Rate limit reached", {"Retry-After": f"{retry_after:.2f}"})
+            return
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+            overloaded = server.capacity and server.in_flight > server.capacity
+            if overloaded:
+                server.overloaded += 1
+        try:
+            if overloaded:
+                self._error(503, "The server is overloaded")
+                return
+            if server.random.random() < server.error_ratio:
+                server.errors += 1
+                self._error(500, "Injected server error")
+                return
+            slow = server.random.random() < server.slow_ratio
+            server.slow += slow
+            time.sleep(server.slow_latency if slow else server.latency)
+            audio = fake_audio(text, body.get("response_format", "mp3"))
+            if audio is None:
+                self._error(400, f"unsupported response_format {body.get('response_format')!r}")
+                return
+            self._send(200, audio, "application/octet-stream")
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+
+def make_server(port=0, rpm=None, cpm=None, period=60.0, latency=0.05, capacity=None,
+                slow_ratio=0.0, slow_latency=2.0, error_ratio=0.0, seed=None):
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeSpeechHandler)
+    server.daemon_threads = True
+    server.limits = Limits(rpm, cpm, period)
+    server.latency = latency
+    server.capacity = capacity      # 동시에 처리할 수 있는 요청 수 (None 이면 무제한)
+    server.in_flight = 0
+    server.peak_in_flight = 0
+    server.overloaded = 0           # 503 으로 돌려보낸 요청 수
+    server.slow_ratio = slow_ratio
+    server.slow_latency = slow_latency
+    server.error_ratio = error_ratio
+    server.slow = 0                 # 늦게 응답한 요청 수
+    server.errors = 0               # 500 으로 응답한 요청 수
+    server.random = random.Random(seed)
+    server.lock = threading.Lock()
+    return server
+
+
+@contextmanager
+def running_server(**kwargs):
+    # with running_server(rpm=...) as server: 동안 백그라운드 스레드에서 서버를 띄운다
+    server = make_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class HTTPStatusError(Exception):
+    # openai.APIStatusError 처럼 status_code 와 response.headers 를 가진 예외
+    def __init__(self, error):
+        super().__init__(f"HTTP {error.code}: {error.reason}")
+        self.status_code = error.code
+        self.response = error
+
+
+class LocalSpeechClient:
+    # openai 패키지 없이 fake 서버를 부르는 최소 클라이언트.
+    # client.audio.speech.with_streaming_response.create(...) 모양만 같다
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.audio = self
+        self.speech = self
+        self.with_streaming_response = self
+
+    @contextmanager
+    def create(self, **kwargs):
+        request = urllib.request.Request(f"{self.base_url}/audio/speech", data=json.dumps(kwargs).encode(),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            raise HTTPStatusError(e) from None
+        with response:
+            yield LocalSpeechResponse(response)
+
+
+class LocalSpeechResponse:
+    def __init__(self, response):
+        self._response = response
+
+    def iter_bytes(self, chunk_size=64 * 1024):
+        return iter(lambda: self._response.read(chunk_size), b"")
+
+    def close(self):
+        self._response.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI TTS 흉내 로컬 서버")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rpm", type=int, default=None, help="분당 요청 수 한도")
+    parser.add_argument("--cpm", type=int, default=None, help="분당 글자 수 한도")
+    parser.add_argument("--latency", type=float, default=0.3, help="응답 지연(초)")
+    parser.add_argument("--capacity", type=int, default=None, help="동시에 처리할 수 있는 요청 수")
+    parser.add_argument("--slow-ratio", type=float, default=0.0, help="늦게 응답할 요청 비율")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="늦은 응답의 지연(초)")
+    parser.add_argument("--error-ratio", type=float, default=0.0, help="500 으로 응답할 요청 비율")
+    args = parser.parse_args()
+    server = make_server(args.port, args.rpm, args.cpm, 60.0, args.latency, args.capacity,
+                         args.slow_ratio, args.slow_latency, args.error_ratio)
+    print(f"Fake TTS server on http://127.0.0.1:{server.server_address[1]}/v1")
+    server.serve_forever()
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# 세션마다 같은 speech.mp3 를 덮어쓰지 않도록, 작업마다 임시 파일에 쓰고
+# 끝나면 내용 해시(또는 합성 계획 해시)로 이름 붙인 파일로 한 번에(os.replace) 공개한다.
+# 계획 해시로 공개한 파일은 완성된 시험 캐시 역할도 한다: 같은 계획이면 lookup() 으로 바로 찾는다.
+# 만드는 중인 작업은 .jobs/<계획 해시>.json 에 문장 키 목록을, .jobs/<계획 해시>.done 에 끝난 문장 키를 한 줄씩
+# 남겨(체크포인트), 실패하거나 서버가 다시 시작해도 같은 계획을 다시 만들 때 끝난 문장은 요청하지 않고 캐시에서 읽는다.
+DEFAULT_OUTPUT_DIR = os.getenv("TTS_OUTPUT_DIR", ".tts_outputs")
+DEFAULT_MAX_BYTES = int(os.getenv("TTS_OUTPUT_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+DEFAULT_MAX_AGE = int(os.getenv("TTS_OUTPUT_MAX_AGE", 24 * 60 * 60))    # 초
+TEMP_MAX_AGE = 60 * 60          # 이보다 오래된 임시 파일은 끝나지 못한 작업으로 보고 지운다
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class JobStore:
+    def __init__(self, root=DEFAULT_OUTPUT_DIR, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.root = Path(root)
+        self.temp_dir = self.root / ".tmp"
+        self.jobs_dir = self.root / ".jobs"
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.gc()
+
+    def new_temp_path(self, suffix=".mp3"):
+        # 작업마다 겹치지 않는 임시 파일 경로 (같은 파일 시스템이라 os.replace 가 원자적)
+        return self.temp_dir / f"{uuid.uuid4().hex}{suffix}"
+
+    def _published_path(self, digest, suffix):
+        return self.root / digest[:2] / f"{digest}{suffix}"
+
+    def publish(self, temp_path, suffix=None, key=None):
+        # 다 쓴 임시 파일을 key(없으면 내용 해시) 경로로 옮긴다. 같은 파일이 이미 있으면 덮어쓴다.
+        temp_path = Path(temp_path)
+        suffix = suffix or temp_path.suffix
+        path = self._published_path(key or file_digest(temp_path), suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(temp_path, path)
+        self.gc()
+        return path
+
+    def publish_bytes(self, data, suffix=".mp3", key=None):
+        temp_path = self.new_temp_path(suffix)
+        temp_path.write_bytes(data)
+        return self.publish(temp_path, suffix, key)
+
+    def lookup(self, key, suffix=".mp3"):
+        # key 로 공개된 파일이 있으면 경로를, 없으면 None 을 돌려준다
+        path = self._published_path(key, suffix)
+        try:
+            os.utime(path)         # 최근 사용 시각 갱신 (용량 정리 때 늦게 지워지도록)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def _checkpoint_path(self, key, suffix=".json"):
+        return self.jobs_dir / f"{key}{suffix}"
+
+    def save_checkpoint(self, key, state):
+        # 새 작업을 시작할 때 한 번: state = {"clip_keys": [...], "total": 전체 문장 수}. 끝난 문장 기록은 비운다
+        path = self._checkpoint_path(key)
+        temp_path = self.new_temp_path(".json")
+        temp_path.write_text(json.dumps(dict(state, updated=time.time())), encoding="utf-8")
+        self.discard(self._checkpoint_path(key, ".done"))
+        os.replace(temp_path, path)
+
+    def mark_done(self, key, clip_key):
+        # 문장 하나가 끝날 때마다 그 키를 한 줄 덧붙인다 (문장마다 전체를 다시 쓰지 않는다)
+        with open(self._checkpoint_path(key, ".done"), "a", encoding="utf-8") as f:
+            f.write(clip_key + "\n")
+
+    def load_checkpoint(self, key):
+        # save_checkpoint() 의 state 에 "done_keys"(끝난 문장 키 집합)와 "done"(그 수)을 더해 돌려준다
+        try:
+            state = json.loads(self._checkpoint_path(key).read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+        try:
+            lines = self._checkpoint_path(key, ".done").read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            lines = []
+        # 쓰다 멈춘 마지막 줄 같은, 목록에 없는 키는 버린다
+        state["done_keys"] = set(lines) & set(state.get("clip_keys", ()))
+        state["done"] = len(state["done_keys"])
+        return state
+
+    def clear_checkpoint(self, key):
+        self.discard(self._checkpoint_path(key))
+        self.discard(self._checkpoint_path(key, ".done"))
+
+    def discard(self, temp_path):
+        try:
+            Path(temp_path).unlink()
+        except FileNotFoundError:
+            pass
+
+    def gc(self):
+        # 1) 오래된 파일 삭제  2) 그래도 용량을 넘으면 오래된 것부터 삭제
+        with self._lock:
+            now = time.time()
+            entries = []
+            total = 0
+            for path in self.root.glob("*/*"):
+                try:
+                    info = path.stat()
+                except FileNotFoundError:
+                    continue   # 다른 프로세스가 먼저 지운 경우
+                max_age = TEMP_MAX_AGE if path.parent == self.temp_dir else self.max_age
+                if now - info.st_mtime > max_age:
+                    self.discard(path)
+                    continue
+                if path.parent not in (self.temp_dir, self.jobs_dir):
+                    entries.append((info.st_mtime, info.st_size, path))
+                    total += info.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self.discard(path)
+                total -= size
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_default_store():
+    # 프로세스 안의 모든 세션이 같은 저장소 객체를 쓴다
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = JobStore()
+        return _default_store
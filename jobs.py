@@ -0,0 +1,98 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# 음원 생성 작업을 스크립트 실행(rerun)과 떼어 백그라운드 스레드에서 돌리고, 언제든 멈출 수 있게 한다.
+# Streamlit 은 버튼을 누를 때마다 스크립트를 처음부터 다시 실행하므로, 작업 객체를 session_state 에 두고
+# 다음 실행에서 진행 상황을 보여 주거나 cancel() 한다.
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    # 멈춤 신호. 기다리는 곳(제한기·동시 요청 자리·재시도 대기)은 wait()/check() 로 확인하고,
+    # 받고 있는 HTTP 응답은 on_cancel() 로 등록해 두면 cancel() 때 바로 닫힌다
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancel callback failed: {e}")
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+    def wait(self, timeout):
+        # timeout 초 기다리되 그 사이 멈추면 바로 JobCancelled
+        if self._event.wait(timeout):
+            raise JobCancelled()
+
+    @contextmanager
+    def on_cancel(self, callback):
+        with self._lock:
+            cancelled = self._event.is_set()
+            if not cancelled:
+                self._callbacks.append(callback)
+        if cancelled:
+            callback()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+
+class BackgroundJob:
+    # fn(job) 을 백그라운드 스레드에서 실행한다. fn 은 job.token 으로 멈춤을 확인하고
+    # job.progress(done, total) 로 진행 상황을 알린다. 결과는 job.result, 오류는 job.error
+    def __init__(self, key, fn):
+        self.key = key
+        self.token = CancelToken()
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.started = time.time()
+        self._fn = fn
+        self._thread = threading.Thread(target=self._run, name=f"tts-job-{id(self):x}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.result = self._fn(self)
+        except BaseException as e:
+            self.error = e
+
+    def progress(self, done, total):
+        self.done, self.total = done, total
+
+    def running(self):
+        return self._thread.is_alive()
+
+    def cancel(self):
+        self.token.cancel()
+
+    @property
+    def cancelled(self):
+        return self.token.cancelled or isinstance(self.error, JobCancelled)
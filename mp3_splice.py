@@ -0,0 +1,214 @@
+import struct
+
+# MP3(MPEG Audio Layer III) 프레임을 디코딩·재인코딩 없이 그대로 이어 붙인다.
+# - 각 음성 앞의 ID3 태그와 Xing/Info/VBRI(LAME) 헤더 프레임은 떼어 낸다
+# - 무음은 음성과 같은 헤더에 본문이 모두 0 인 프레임(= 무음으로 디코딩됨)으로 만든다
+# - 인코더 지연(delay)·패딩만큼 다음 무음을 줄여 대사 간격을 맞춘다
+
+# 버전 비트 -> (이름, 샘플레이트 표)
+_VERSIONS = {3: ("1", (44100, 48000, 32000)), 2: ("2", (22050, 24000, 16000)), 0: ("2.5", (11025, 12000, 8000))}
+_BITRATES = {
+    "1": (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    "2": (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+DECODER_DELAY = 529            # 디코더가 앞에 더하는 샘플 수 (LAME 기준)
+DEFAULT_ENCODER_DELAY = 576    # LAME 태그가 없을 때 가정하는 인코더 지연
+
+
+class FrameHeader:
+    __slots__ = ("version", "sample_rate", "bitrate", "padding", "protected", "mono", "length",
+                 "samples", "side_info")
+
+    def __init__(self, raw):
+        b1, b2, b3 = raw[1], raw[2], raw[3]
+        version_bits = (b1 >> 3) & 0x3
+        layer_bits = (b1 >> 1) & 0x3
+        bitrate_index = b2 >> 4
+        rate_index = (b2 >> 2) & 0x3
+        if version_bits not in _VERSIONS or layer_bits != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            raise ValueError("not an MPEG Layer III frame header")
+        self.version, rates = _VERSIONS[version_bits]
+        self.sample_rate = rates[rate_index]
+        self.bitrate = _BITRATES["1" if self.version == "1" else "2"][bitrate_index] * 1000
+        self.padding = (b2 >> 1) & 0x1
+        self.protected = not (b1 & 0x1)
+        self.mono = (b3 >> 6) == 3
+        if self.version == "1":
+            self.samples = 1152
+            self.length = 144 * self.bitrate // self.sample_rate + self.padding
+            self.side_info = 17 if self.mono else 32
+        else:
+            self.samples = 576
+            self.length = 72 * self.bitrate // self.sample_rate + self.padding
+            self.side_info = 9 if self.mono else 17
+
+    def stream_key(self):
+        # 이어 붙일 수 있는 스트림인지 판단할 값
+        return self.version, self.sample_rate, self.mono
+
+
+def _is_sync(data, pos):
+    return data[pos] == 0xFF and (data[pos + 1] & 0xE0) == 0xE0
+
+
+def _skip_id3v2(data):
+    if data[:3] != b"ID3" or len(data) < 10:
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _read_lame_tag(frame, header):
+    # Xing/Info 헤더면 (encoder delay, padding) 을, 아니면 None 을 돌려준다
+    offset = 4 + (2 if header.protected else 0) + header.side_info
+    tag = frame[offset:offset + 4]
+    if tag not in (b"Xing", b"Info"):
+        return None if frame[36:40] != b"VBRI" else (DEFAULT_ENCODER_DELAY, 0)
+    flags = struct.unpack(">I", frame[offset + 4:offset + 8])[0]
+    pos = offset + 8
+    pos += 4 if flags & 0x1 else 0      # 프레임 수
+    pos += 4 if flags & 0x2 else 0      # 바이트 수
+    pos += 100 if flags & 0x4 else 0    # TOC
+    pos += 4 if flags & 0x8 else 0      # 품질
+    if frame[pos:pos + 4] in (b"LAME", b"Lavf", b"Lavc") and len(frame) >= pos + 24:
+        d = frame[pos + 21:pos + 24]
+        return (d[0] << 4) | (d[1] >> 4), ((d[1] & 0x0F) << 8) | d[2]
+    return DEFAULT_ENCODER_DELAY, 0
+
+
+class Mp3Clip:
+    __slots__ = ("frames", "header", "delay", "padding")
+
+    def __init__(self, frames, header, delay, padding):
+        self.frames = frames        # 오디오 프레임(bytes) 목록
+        self.header = header        # 첫 오디오 프레임의 헤더
+        self.delay = delay
+        self.padding = padding
+
+    def samples(self):
+        return len(self.frames) * self.header.samples
+
+    def extra_samples(self):
+        # 실제 음성 외에 디코딩 결과에 더해지는 샘플 수
+        return self.delay + DECODER_DELAY + self.padding
+
+
+def parse_mp3(data):
+    data = bytes(data)
+    pos = _skip_id3v2(data)
+    end = len(data) - (128 if data[-128:-125] == b"TAG" else 0)
+    frames = []
+    first = None
+    delay, padding = DEFAULT_ENCODER_DELAY, 0
+    while pos + 4 <= end:
+        if not _is_sync(data, pos):
+            pos += 1                      # 프레임 사이의 쓰레기 바이트 건너뛰기
+            continue
+        try:
+            header = FrameHeader(data[pos:pos + 4])
+        except ValueError:
+            pos += 1
+            continue
+        if pos + header.length > end:
+            break                         # 잘린 마지막 프레임은 버린다
+        frame = data[pos:pos + header.length]
+        if first is None:
+            lame = _read_lame_tag(frame, header)
+            if lame is not None:
+                delay, padding = lame
+                pos += header.length
+                continue
+            first = header
+        elif header.stream_key() != first.stream_key():
+            raise ValueError("MP3 clip changes sample rate or channel mode mid-stream")
+        frames.append(frame)
+        pos += header.length
+    if first is None:
+        raise ValueError("no MP3 audio frames found")
+    return Mp3Clip(frames, first, delay, padding)
+
+
+def read_preamble(data):
+    # 받는 중인 MP3 의 앞부분에서 (첫 오디오 프레임 위치, (인코더 delay, padding)) 을 읽는다.
+    # LAME 태그가 없으면 두 번째 값은 None. ID3 태그나 첫 프레임(Xing/Info 헤더일 수 있음)을
+    # 아직 다 받지 못했으면 None
+    if len(data) < 10 and b"ID3".startswith(bytes(data[:3])):
+        return None
+    pos = _skip_id3v2(data)
+    while pos + 4 <= len(data):
+        if not _is_sync(data, pos):
+            pos += 1
+            continue
+        try:
+            header = FrameHeader(data[pos:pos + 4])
+        except ValueError:
+            pos += 1
+            continue
+        if pos + header.length > len(data):
+            return None
+        lame = _read_lame_tag(data[pos:pos + header.length], header)
+        return (pos, None) if lame is None else (pos + header.length, lame)
+    return None
+
+
+def silent_frame(reference):
+    # 기준 프레임과 같은 헤더(패딩·CRC 없음)에 side info·본문이 모두 0 인 프레임
+    raw = bytearray(reference[:4])
+    raw[1] |= 0x01          # CRC 없음
+    raw[2] &= ~0x02 & 0xFF  # 패딩 없음
+    header = FrameHeader(raw)
+    return bytes(raw) + b"\0" * (header.length - 4)
+
+
+def info_frame(reference, frame_count, byte_count, vbr=False):
+    # 출력 맨 앞에 붙이는 Xing/Info 헤더: 플레이어에 재생 시간·탐색 정보를 알려 준다
+    frame = bytearray(silent_frame(reference))
+    header = FrameHeader(frame[:4])
+    offset = 4 + header.side_info
+    tag = b"Xing" if vbr else b"Info"
+    frame[offset:offset + 16] = tag + struct.pack(">III", 0x3, frame_count, byte_count)
+    return bytes(frame)
+
+
+class Mp3Splicer:
+    # Timeline 과 같은 방식(add_clip / add_silence / render)으로 MP3 바이트를 바로 잇는다
+    def __init__(self):
+        self._items = []
+        self._reference = None
+
+    def add_clip(self, data):
+        clip = parse_mp3(data)
+        if self._reference is None:
+            self._reference = clip.frames[0]
+        elif clip.header.stream_key() != FrameHeader(self._reference[:4]).stream_key():
+            raise ValueError("MP3 clips use different sample rates or channel modes")
+        self._items.append(clip)
+
+    def add_silence(self, duration_ms):
+        if duration_ms > 0:
+            self._items.append(float(duration_ms))
+
+    def __len__(self):
+        return len(self._items)
+
+    def render(self):
+        if self._reference is None:
+            raise ValueError("no MP3 clips to splice")
+        header = FrameHeader(self._reference[:4])
+        silence = silent_frame(self._reference)
+        out = []
+        bitrates = {header.bitrate}
+        trim = 0        # 앞 음성의 지연·패딩만큼 다음 무음에서 빼 줄 샘플 수
+        for item in self._items:
+            if isinstance(item, Mp3Clip):
+                out.extend(item.frames)
+                bitrates.update(FrameHeader(frame[:4]).bitrate for frame in item.frames)
+                trim += item.extra_samples()
+            else:
+                wanted = item * header.sample_rate / 1000.0 - trim
+                trim = 0
+                count = max(0, round(wanted / header.samples))
+                out.extend([silence] * count)
+        body = b"".join(out)
+        return info_frame(self._reference, len(out), len(body) + len(silence), vbr=len(bitrates) > 1) + body
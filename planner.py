@@ -0,0 +1,259 @@
+import hashlib
+import json
+import math
+import os
+import random
+import re
+
+from tts_engine import SpeechRequest, request_key, DEFAULT_MODEL, DEFAULT_INSTRUCTIONS
+
+# 합성 전에 모든 발화를 (음성, 모델, 문장, 지시문, 속도, 형식) 요청으로 확정한다.
+# 'random' 음성도 작업에 저장된 seed 로 고르므로, 같은 입력이면 항상 같은 요청이 나온다.
+# 같은 요청("Number One." 처럼 문제마다 반복되는 문장)은 한 번만 합성하고 타임라인에서 여러 번 가리킨다.
+
+FEMALE_VOICES = ['alloy', 'fable', 'nova', 'shimmer']
+MALE_VOICES = ['echo', 'onyx']
+
+# 묶어 요청하기(coalesce): 한 문제 안에서 이어지는 같은 음성·톤·속도 문장을 한 번에 요청한다.
+# 받은 음성은 문장 사이 무음에서 다시 잘라야 하므로 자를 수 있는 형식(pcm/wav)에서만 묶는다
+COALESCE_FORMATS = ("pcm", "wav")
+COALESCE_MAX_LINES = 6
+COALESCE_MAX_CHARS = 800
+
+# 긴 발화 나누기(segment): 줄바꿈 없는 긴 지문은 요청 하나가 전체 시간을 잡아먹고 API 입력 한도(4096자)도
+# 넘을 수 있으므로, SEGMENT_MAX_CHARS 를 넘으면 문장·절 경계에서 비슷한 길이의 조각으로 나눠 동시에 합성한다.
+# 조각 사이에는 문장 간격보다 짧은 간격("chunk")을 둔다
+SEGMENT_MAX_CHARS = int(os.getenv("TTS_SEGMENT_MAX_CHARS", 400))
+_SENTENCE_BREAK = re.compile(r'(?<=[.?!])\s+')
+_CLAUSE_BREAK = re.compile(r'(?<=[,;:])\s+|\s+(?=[-–—]\s)')
+_WORD_BREAK = re.compile(r'\s+')
+SEGMENT_TOLERANCE = 0.2     # 조각 끝을 목표 자리에서 목표 길이의 이 비율까지 옮겨 문장·절 경계를 찾는다
+SEGMENT_EXTRA_CHUNKS = 2    # 공백에서 자를 수 없을 때 더 나눠 볼 조각 수
+
+
+def num_to_korean(n):
+    digit = ["", "일", "이", "삼", "사", "오", "육", "칠", "팔", "구"]
+    unit  = ["", "십", "백", "천"]
+    n = int(n)
+    if n == 0:
+        return "영"
+    result = ""
+    str_n = str(n)
+    length = len(str_n)
+    for i, ch in enumerate(str_n):
+        num = int(ch)
+        u = unit[length - i - 1]
+        if num == 0:
+            continue
+        # 만약 자릿수가 십·백·천이고 값이 1이면 '일' 생략
+        if num == 1 and u != "":
+            result += u
+        else:
+            result += digit[num] + u
+    return result
+
+
+def pick_voice(option, gender, question_index, seed):
+    # order: 문제마다 차례로, random: 문제마다 (seed, 문제 순서, 성별) 로 정해지는 무작위 음성
+    voices = FEMALE_VOICES if gender == "female" else MALE_VOICES
+    if option == "order":
+        return voices[question_index % len(voices)]
+    if option == "random":
+        return random.Random(f"{seed}:{question_index}:{gender}").choice(voices)
+    return option
+
+
+class Plan:
+    __slots__ = ("requests", "timeline", "numbers", "speech_numbers", "batches", "seed", "_index")
+
+    def __init__(self, seed=0):
+        self.requests = []      # 서로 다른 SpeechRequest 목록 (합성 순서 = 타임라인에 처음 나오는 순서)
+        self.timeline = []      # ("speech", 요청 번호) / ("interline", None) / ("chunk", None) / ("internum", 앞 문제 번호)
+        self.numbers = []       # 요청마다 처음 나온 문제 번호 (안내문은 None)
+        self.speech_numbers = []    # 타임라인의 "speech" 마다 속한 문제 번호
+        self.batches = []       # 한 번에 요청할 연속된 요청 번호 목록들 (묶지 않으면 모두 한 개짜리)
+        self.seed = seed
+        self._index = {}        # request_key -> 요청 번호
+
+    def __len__(self):
+        return len(self.requests)
+
+    def add_speech(self, request, number):
+        # 타임라인에 문장을 넣고 요청 번호를 돌려준다. 이미 있는 요청이면 그 번호를 다시 가리킨다
+        key = request_key(request)
+        index = self._index.get(key)
+        if index is None:
+            index = self._index[key] = len(self.requests)
+            self.requests.append(request)
+            self.numbers.append(number)
+        self.timeline.append(("speech", index))
+        self.speech_numbers.append(number)
+        return index
+
+    def reused(self):
+        # 같은 요청을 다시 가리켜 합성하지 않아도 되는 문장 수
+        return len(self.speech_numbers) - len(self.requests)
+
+    def rows(self):
+        # 합성 전에 확인할 수 있도록 표 형태로
+        uses = [0] * len(self.requests)
+        for kind, value in self.timeline:
+            if kind == "speech":
+                uses[value] += 1
+        return [{"문제": number or "", "음성": r.voice, "톤": r.instructions, "문장": r.text, "횟수": count}
+                for r, number, count in zip(self.requests, self.numbers, uses)]
+
+    def question_numbers(self):
+        # 요청이 있는 문제 번호 (대본 순서, 안내문은 None)
+        return list(dict.fromkeys(self.speech_numbers))
+
+    def question(self, number):
+        # 한 문제의 문장만 담은 계획 (미리 듣기용, 문장 사이 간격만 둔다)
+        plan = Plan(self.seed)
+        included = False
+        numbers = iter(self.speech_numbers)
+        for kind, value in self.timeline:
+            if kind == "speech":
+                included = next(numbers) == number
+                if included:
+                    plan.add_speech(self.requests[value], number)
+            elif included and kind != "internum":
+                plan.timeline.append((kind, value))
+        plan.batches = [[i] for i in range(len(plan.requests))]
+        return plan
+
+    def calls(self):
+        # 실제로 보낼 API 요청 수
+        return len(self.batches)
+
+
+def _cut(text, start, target, lowest, highest):
+    # text[start:] 에서 조각을 끝낼 (끝, 다음 조각 시작). target 에서 가장 가까운 문장 → 절 → 단어 경계를 찾는다
+    # (다음 조각 시작이 lowest 이상·끝이 highest 이하여야 한다). 그런 경계가 없으면 None
+    # 문장·절 경계는 목표 길이의 SEGMENT_TOLERANCE 안에서만 쓰고, 단어 경계는 범위 안 어디든 쓴다
+    slack = (target - start) * SEGMENT_TOLERANCE
+    for pattern, near in ((_SENTENCE_BREAK, True), (_CLAUSE_BREAK, True), (_WORD_BREAK, False)):
+        cuts = [(m.start(), m.end()) for m in pattern.finditer(text, start)
+                if m.end() >= lowest and start < m.start() <= highest and (not near or abs(m.start() - target) <= slack)]
+        if cuts:
+            return min(cuts, key=lambda cut: abs(cut[0] - target))
+    return None
+
+
+def _split(text, count, max_chars, hard=False):
+    # text 를 count 개의 max_chars 이하 조각으로 나눈다. 조각마다 남은 글자를 남은 조각 수로 나눈 자리를 목표로
+    # 삼으므로, 앞 조각이 짧게 끝나면 뒤 조각들의 목표가 그만큼 뒤로 밀린다.
+    # 공백에서 자를 수 없는 자리가 있으면 None (hard=True 면 그 자리는 목표에서 바로 자른다)
+    chunks = []
+    start = 0
+    for left in range(count, 1, -1):
+        target = start + (len(text) - start) / left
+        # 이 조각은 max_chars 이하, 남은 글자는 남은 조각들에 max_chars 씩 들어가야 한다
+        cut = _cut(text, start, target, len(text) - (left - 1) * max_chars, start + max_chars)
+        if cut is None:
+            if not hard:
+                return None
+            cut = (round(target), round(target))
+        chunks.append(text[start:cut[0]].strip())
+        start = cut[1]
+    chunks.append(text[start:].strip())
+    return chunks
+
+
+def segment_text(text, max_chars=SEGMENT_MAX_CHARS):
+    # 긴 발화를 ceil(길이 / max_chars) 개의, 길이가 거의 같은 max_chars 이하 조각으로 나눈다. 짧으면 그대로 한 조각
+    # 길이가 한도에 꽉 차 공백에서 자를 여유가 없으면 조각을 하나(둘)씩 늘려 본다. 그래도 안 되면(공백 없이 긴 글자열)
+    # 그 자리만 단어 가운데를 자른다
+    text = text.strip()
+    if not max_chars or len(text) <= max_chars:
+        return [text]
+    count = math.ceil(len(text) / max_chars)
+    for extra in range(SEGMENT_EXTRA_CHUNKS + 1):
+        chunks = _split(text, count + extra, max_chars)
+        if chunks is not None:
+            return chunks
+    return _split(text, count, max_chars, hard=True)
+
+
+def group_batches(requests, numbers, max_lines=COALESCE_MAX_LINES, max_chars=COALESCE_MAX_CHARS, separate=()):
+    # 같은 문제 안에서 이어지고 문장만 다른(음성·모델·톤·속도·형식이 같은) 요청끼리 묶는다
+    # separate: 묶지 않을 요청 번호 (긴 발화를 나눈 조각은 동시에 합성해야 하므로)
+    batches = []
+    for i, request in enumerate(requests):
+        if batches and i not in separate and batches[-1][0] not in separate:
+            batch = batches[-1]
+            head = requests[batch[0]]
+            if (numbers[i] == numbers[batch[0]] and request._replace(text="") == head._replace(text="")
+                    and len(batch) < max_lines
+                    and sum(len(requests[j].text) for j in batch) + len(request.text) <= max_chars):
+                batch.append(i)
+                continue
+        batches.append([i])
+    return batches
+
+
+def plan_exam(exam, ko_voice, female_option, male_option, speed=1.0, response_format="mp3", seed=0,
+              model=DEFAULT_MODEL, instructions=DEFAULT_INSTRUCTIONS, coalesce=False,
+              segment_chars=SEGMENT_MAX_CHARS):
+    plan = Plan(seed)
+    segmented = set()       # 긴 발화를 나눈 조각들의 요청 번호
+    previous_number = None
+    question_index = 0      # 번호가 있는 문제의 순서 (1부터, 첫 문제 앞 안내문은 0)
+    current_voice = ko_voice
+    for question in exam.questions:
+        # 새 문제: 문제 순서를 넘기고, 첫 문제가 아니면 문제 간격 추가
+        if question.number is not None:
+            if question_index:
+                plan.timeline.append(("internum", previous_number))
+            question_index += 1
+            previous_number = question.number
+
+        for utterance in question.utterances:
+            # 문제 번호 읽기
+            if utterance.number:
+                text = f"{num_to_korean(utterance.number)}번 문제입니다. {utterance.text}"
+            else:
+                text = utterance.text
+
+            # 음성 지표가 있을 때만 목소리 변경, 없으면 직전 목소리 유지
+            if utterance.speaker == "female":
+                current_voice = pick_voice(female_option, "female", question_index, seed)
+            elif utterance.speaker == "male":
+                current_voice = pick_voice(male_option, "male", question_index, seed)
+
+            if text.strip():
+                chunks = segment_text(text, segment_chars)
+                for n, chunk in enumerate(chunks):
+                    if n:
+                        plan.timeline.append(("chunk", None))     # 조각 사이의 짧은 간격
+                    index = plan.add_speech(SpeechRequest(
+                        model=model,
+                        voice=current_voice,
+                        text=chunk,
+                        speed=speed,
+                        instructions=utterance.tone or instructions,
+                        response_format=response_format,
+                    ), question.number)
+                    if len(chunks) > 1:
+                        segmented.add(index)
+                # 문장 사이 무음
+                plan.timeline.append(("interline", None))
+    if coalesce and response_format in COALESCE_FORMATS:
+        plan.batches = group_batches(plan.requests, plan.numbers, separate=segmented)
+    else:
+        plan.batches = [[i] for i in range(len(plan.requests))]
+    return plan
+
+
+def exam_key(plan, interline, internum, overrides=None):
+    # 완성된 시험 음원을 찾는 키: 모든 요청(음성·문장·톤·속도·형식)과 타임라인, 간격을 해시
+    # 묶어 요청한 음원은 문장별로 요청한 음원과 다르므로 묶음도 넣는다
+    fields = {
+        "requests": [list(r) for r in plan.requests],
+        "timeline": plan.timeline,
+        "gaps": [interline, internum, sorted((overrides or {}).items())],
+    }
+    if plan.calls() < len(plan):
+        fields["batches"] = plan.batches
+    payload = json.dumps(fields, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
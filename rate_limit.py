@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+# 모든 세션의 TTS 요청이 함께 지나가는 토큰 버킷 제한기.
+# 분당 요청 수와 분당 글자 수 두 개의 버킷에서 모두 토큰을 얻을 때까지 기다렸다가(대기열) 요청을 보낸다.
+# 한도를 넘겨 429 를 받으면 실패시키지 않고 Retry-After 만큼 모든 요청을 멈춘 뒤 다시 보낸다.
+DEFAULT_REQUESTS_PER_MIN = float(os.getenv("TTS_REQUESTS_PER_MIN", 500))
+DEFAULT_CHARS_PER_MIN = float(os.getenv("TTS_CHARS_PER_MIN", 200000))
+DEFAULT_RETRY_AFTER = 1.0       # 429 응답에 Retry-After 가 없을 때 기다리는 시간(초)
+# 우선 요청(한 문제 미리 듣기)만 꺼낼 수 있도록 버킷에 남겨 두는 토큰 (버킷의 절반까지)
+PRIORITY_RESERVE_REQUESTS = 8
+PRIORITY_RESERVE_CHARS = 2000
+
+
+class TokenBucket:
+    # rate 개/period 초 로 채워지고 최대 capacity 개까지 쌓이는 버킷
+    def __init__(self, rate, period=60.0, capacity=None):
+        self.rate = rate / period       # 초당 채워지는 토큰
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now, reserve=0.0):
+        # amount 개를 꺼내고도 reserve 개가 남으려면 몇 초 더 기다려야 하는지 (버킷보다 큰 요청은 가득 찰 때까지만)
+        self._refill(now)
+        amount = min(amount, self.capacity - reserve)
+        return max(0.0, (amount + reserve - self.tokens) / self.rate)
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_min=DEFAULT_REQUESTS_PER_MIN, chars_per_min=DEFAULT_CHARS_PER_MIN, period=60.0):
+        self.requests = TokenBucket(requests_per_min, period)
+        self.chars = TokenBucket(chars_per_min, period)
+        self.reserve = (min(PRIORITY_RESERVE_REQUESTS, self.requests.capacity / 2),
+                        min(PRIORITY_RESERVE_CHARS, self.chars.capacity / 2))
+        self.paused_until = 0.0         # 429 를 받으면 이 시각까지 모든 요청을 멈춘다
+        self.waited = 0.0               # 대기열에서 기다린 시간 합계(초)
+        self.throttled = 0              # 받은 429 횟수
+        self._lock = threading.Lock()     # 버킷 상태. 계산하는 동안만 쥐고, 기다릴 때는 놓는다
+        self._cond = threading.Condition(self._lock)
+        self._turn = threading.Lock()     # 일반 요청의 줄. 맨 앞 요청이 이 잠금을 쥔 채로 토큰을 기다린다
+        self._priority_waiting = 0        # 토큰을 기다리는 우선 요청 수. 0 이 아니면 일반 요청은 토큰을 꺼내지 않는다
+
+    def acquire(self, chars=0, cancel=None, priority=False):
+        # 두 버킷에서 토큰을 얻을 때까지 기다린다. 일반 요청은 먼저 온 요청이 먼저 나가도록 줄을 서고,
+        # priority=True(한 문제 미리 듣기)는 줄을 서지 않고, 일반 요청이 남겨 둔 토큰(reserve)을 쓸 수 있으며,
+        # 기다리게 되면 다음 토큰을 일반 요청보다 먼저 가져간다 (429 의 Retry-After 는 지킨다)
+        # cancel(CancelToken) 이 멈추면 기다리던 중에도 0.1초 안에 JobCancelled
+        with self._turn if not priority else nullcontext():
+            start = time.monotonic()
+            reserve_requests, reserve_chars = (0, 0) if priority else self.reserve
+            with self._cond:
+                if priority:
+                    self._priority_waiting += 1
+                try:
+                    while True:
+                        now = time.monotonic()
+                        delay = max(self.paused_until - now,
+                                    self.requests.wait_time(1, now, reserve_requests),
+                                    self.chars.wait_time(chars, now, reserve_chars))
+                        # 우선 요청이 기다리는 동안 일반 요청은 우선 요청이 모두 토큰을 얻을 때까지(notify) 기다린다
+                        blocked = not priority and self._priority_waiting
+                        if delay <= 0 and not blocked:
+                            self.requests.take(1)
+                            self.chars.take(chars)
+                            self.waited += now - start
+                            return
+                        timeout = None if blocked else delay
+                        if cancel is not None:
+                            cancel.check()
+                            timeout = min(timeout or 0.1, 0.1)
+                        self._cond.wait(timeout)
+                finally:
+                    if priority:
+                        self._priority_waiting -= 1
+                        self._cond.notify_all()
+
+    def try_acquire(self, chars=0):
+        # 지금 바로 두 버킷에서 토큰을 얻을 수 있으면 얻고 True, 아니면 기다리지 않고 False (우선 요청 몫은 남긴다)
+        with self._lock:
+            now = time.monotonic()
+            delay = max(self.paused_until - now,
+                        self.requests.wait_time(1, now, self.reserve[0]),
+                        self.chars.wait_time(chars, now, self.reserve[1]))
+            if self._priority_waiting or delay > 0:
+                return False
+            self.requests.take(1)
+            self.chars.take(chars)
+            return True
+
+    def backoff(self, retry_after=None):
+        # 429 를 받았을 때: 모든 세션의 다음 요청을 retry_after 초 뒤로 미룬다
+        delay = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+        until = time.monotonic() + delay
+        with self._lock:
+            self.paused_until = max(self.paused_until, until)
+            self.throttled += 1
+
+
+def retry_after_of(error):
+    # 429 예외(openai.RateLimitError 등)의 Retry-After 헤더(초). 없으면 None
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+_default_limiter = None
+_default_lock = threading.Lock()
+
+
+def get_default_limiter():
+    # 프로세스 안의 모든 세션이 같은 제한기를 쓴다
+    global _default_limiter
+    with _default_lock:
+        if _default_limiter is None:
+            _default_limiter = RateLimiter()
+        return _default_limiter
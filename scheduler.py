@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+# 모든 세션의 TTS 작업을 하나의 작업자 풀에서 세션(tenant)별로 돌아가며 처리한다.
+# 40문제짜리 시험을 만드는 세션과 두 줄을 미리 듣는 세션이 같이 있어도,
+# 한 바퀴에 세션마다 하나씩 꺼내므로 작은 작업은 금방 끝나고 큰 작업도 꾸준히 진행된다.
+# 한 문제 미리 듣기는 우선 처리 줄(priority)로 들어가 쌓여 있는 전체 시험 작업보다 먼저 꺼내지고,
+# 우선 처리 줄만 맡는 작업자가 따로 있어 다른 작업자가 모두 바빠도 바로 시작된다.
+DEFAULT_SCHEDULER_WORKERS = int(os.getenv("TTS_SCHEDULER_WORKERS", 16))
+DEFAULT_PRIORITY_WORKERS = 2
+TENANT_IDLE_EXPIRY = 60 * 60     # 이 시간 동안 일이 없던 세션의 측정값은 지운다(초)
+
+
+class TenantStats:
+    __slots__ = ("queued", "running", "started", "completed", "total_wait", "max_wait", "last_active")
+
+    def __init__(self):
+        self.queued = 0
+        self.running = 0
+        self.started = 0
+        self.completed = 0
+        self.total_wait = 0.0       # 대기열에서 기다린 시간 합계(초)
+        self.max_wait = 0.0
+        self.last_active = time.monotonic()
+
+
+class FairScheduler:
+    def __init__(self, workers=DEFAULT_SCHEDULER_WORKERS, priority_workers=DEFAULT_PRIORITY_WORKERS):
+        self.workers = workers
+        self._queues = OrderedDict()    # tenant -> deque[(future, fn, args, 넣은 시각)], 일이 남은 세션만
+        self._priority = deque()        # (tenant, (future, fn, args, 넣은 시각)) 먼저 들어온 순서대로
+        self._stats = {}
+        self._cond = threading.Condition()
+        for n in range(workers):
+            threading.Thread(target=self._work, name=f"tts-scheduler-{n}", daemon=True).start()
+        for n in range(priority_workers):
+            threading.Thread(target=self._work, args=(True,), name=f"tts-priority-{n}", daemon=True).start()
+
+    def submit(self, tenant, fn, *args, priority=False):
+        future = Future()
+        with self._cond:
+            item = (future, fn, args, time.monotonic())
+            if priority:
+                self._priority.append((tenant, item))
+            else:
+                self._queues.setdefault(tenant, deque()).append(item)
+            stats = self._stats.setdefault(tenant, TenantStats())
+            stats.queued += 1
+            stats.last_active = time.monotonic()
+            self._cond.notify_all()
+        return future
+
+    def _next(self):
+        # 우선 처리 줄이 먼저, 없으면 맨 앞 세션에서 하나 꺼내고 그 세션은 맨 뒤로 보낸다 (round-robin)
+        if self._priority:
+            return self._priority.popleft()
+        tenant, queue = next(iter(self._queues.items()))
+        item = queue.popleft()
+        if queue:
+            self._queues.move_to_end(tenant)
+        else:
+            del self._queues[tenant]
+        return tenant, item
+
+    def _work(self, priority_only=False):
+        while True:
+            with self._cond:
+                while not (self._priority or (self._queues and not priority_only)):
+                    self._cond.wait()
+                tenant, (future, fn, args, enqueued) = self._next()
+                stats = self._stats[tenant]
+                stats.queued -= 1
+                if not future.set_running_or_notify_cancel():
+                    continue        # 기다리는 동안 취소된 작업
+                wait = time.monotonic() - enqueued
+                stats.running += 1
+                stats.started += 1
+                stats.total_wait += wait
+                stats.max_wait = max(stats.max_wait, wait)
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            with self._cond:
+                stats.running -= 1
+                stats.completed += 1
+                stats.last_active = time.monotonic()
+
+    def snapshot(self):
+        # 세션별 대기열 깊이와 대기 시간
+        with self._cond:
+            now = time.monotonic()
+            for tenant in [t for t, s in self._stats.items()
+                           if not s.queued and not s.running and now - s.last_active > TENANT_IDLE_EXPIRY]:
+                del self._stats[tenant]
+            return {tenant: {"queued": s.queued, "running": s.running, "completed": s.completed,
+                             "avg_wait_ms": round(1000 * s.total_wait / s.started) if s.started else 0,
+                             "max_wait_ms": round(1000 * s.max_wait)}
+                    for tenant, s in self._stats.items()}
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+def get_default_scheduler():
+    # 프로세스 안의 모든 세션이 같은 스케줄러를 쓴다
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = FairScheduler()
+        return _default_scheduler
@@ -0,0 +1,115 @@
+import re
+
+# 듣기평가 대본을 한 번 훑으면서 시험(Exam) → 문제(Question) → 발화(Utterance) 구조로 바꾼다.
+# 문장 합치기(merge_lines)와 톤·화자·문제번호·언어 판별을 한 줄씩 바로 처리하고,
+# 정규식은 모듈을 불러올 때 한 번만 컴파일한다.
+
+_TONE = re.compile(r'^\s*\[([^\]]+)\]\s*(.*)')
+_MALE = re.compile(r'^\s*M\s*:?\s*(.*)')
+_FEMALE = re.compile(r'^\s*W\s*:?\s*(.*)')
+_QUESTION = re.compile(r'^\s*(\d+)\s*\.?\s*번?\s*(.*)')
+_HANGUL = re.compile(r'[가-힣]+')
+_LATIN = re.compile(r'[a-zA-Z]+')
+_SENTENCE_END = ('.', '?', '!')
+
+
+class Utterance:
+    __slots__ = ("text", "speaker", "tone", "language", "number", "line")
+
+    def __init__(self, text, speaker=None, tone=None, language="en", number=None, line=0):
+        self.text = text            # 톤·화자·번호를 뗀 본문
+        self.speaker = speaker      # "male" / "female" / None(직전 화자 유지)
+        self.tone = tone            # [지시어] 내용 또는 None
+        self.language = language    # "ko" / "en"
+        self.number = number        # 이 문장 앞에 적힌 문제 번호 (문자열) 또는 None
+        self.line = line            # 문장이 끝난 대본 줄 번호 (0부터)
+
+    def __repr__(self):
+        return (f"Utterance({self.text!r}, speaker={self.speaker!r}, tone={self.tone!r}, "
+                f"language={self.language!r}, number={self.number!r})")
+
+
+class Question:
+    __slots__ = ("number", "utterances")
+
+    def __init__(self, number=None):
+        self.number = number        # 첫 문제 앞의 안내문은 None
+        self.utterances = []
+
+    def __repr__(self):
+        return f"Question({self.number!r}, {len(self.utterances)} utterances)"
+
+
+class Exam:
+    __slots__ = ("questions",)
+
+    def __init__(self):
+        self.questions = []
+
+    def utterances(self):
+        for question in self.questions:
+            yield from question.utterances
+
+    def __repr__(self):
+        return f"Exam({len(self.questions)} questions)"
+
+
+def language_of(text):
+    # 한글 글자 수가 영문 글자 수보다 많으면 한국어
+    return "ko" if sum(map(len, _HANGUL.findall(text))) > sum(map(len, _LATIN.findall(text))) else "en"
+
+
+def parse_sentence(sentence, line=0):
+    # 합쳐진 한 문장에서 [톤] → 화자(M:/W:) → 문제 번호 순서로 떼어 낸다
+    sentence = sentence.lstrip()
+    language = language_of(sentence)
+
+    tone = None
+    m = _TONE.match(sentence)
+    if m:
+        tone, sentence = m.group(1).strip(), m.group(2)
+
+    speaker = None
+    m = _MALE.match(sentence)
+    if m:
+        speaker, sentence = "male", m.group(1).strip()
+    else:
+        m = _FEMALE.match(sentence)
+        if m:
+            speaker, sentence = "female", m.group(1).strip()
+
+    number = None
+    m = _QUESTION.match(sentence)
+    if m:
+        number, sentence = m.group(1).strip(), m.group(2).strip()
+    else:
+        sentence = sentence.lstrip()
+
+    return Utterance(sentence, speaker, tone, language, number, line)
+
+
+def iter_sentences(lines):
+    # 마침표·물음표·느낌표로 끝나는 줄까지 이어 붙여 한 문장으로 본다
+    parts = []
+    for index, line in enumerate(lines):
+        line = line.strip()
+        parts.append(line)
+        if line.endswith(_SENTENCE_END):
+            yield " ".join(parts).strip(), index
+            parts = []
+    if parts:
+        yield " ".join(parts).strip(), len(lines) - 1
+
+
+def parse_script(text):
+    exam = Exam()
+    question = None
+    current_number = None
+    for sentence, line in iter_sentences(text.split('\n')):
+        utterance = parse_sentence(sentence, line)
+        if question is None or (utterance.number and utterance.number != current_number):
+            current_number = utterance.number or current_number
+            question = Question(utterance.number)
+            exam.questions.append(question)
+        question.utterances.append(utterance)
+    return exam
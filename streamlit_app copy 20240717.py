@@ -6,6 +6,7 @@ from dotenv import load_dotenv
 from collections import Counter
 import re
 import random
+from mp3_splice import Mp3Splicer
 
 # CSS 스타일 추가
 st.markdown(
@@ -164,7 +165,7 @@ sequential 은 문제마다 해당 성별의 음성을 순서대로 바꿔 줍
             input_text = st.session_state.input_text
             lines = input_text.split('\n')
             sentences = merge_lines(lines)
-            tts = bytearray()
+            tts = Mp3Splicer()  # MP3 프레임을 디코딩 없이 그대로 이어 붙임
             current_number = None
 
             # 초기화된 현재 여성 및 남성 목소리
@@ -214,13 +215,12 @@ sequential 은 문제마다 해당 성별의 음성을 순서대로 바꿔 줍
                     )
                     print(f"Text to convert: {text_to_convert}, Using voice: {current_voice}")
 
-                    for chunk in response.iter_bytes():
-                        tts.extend(chunk)
+                    tts.add_clip(b"".join(response.iter_bytes()))
 
-                    tts.extend(b'\x00' * (st.session_state.interline * 16000 // 1000))  # Add interline interval
+                    tts.add_silence(st.session_state.interline)  # 무음 MP3 프레임으로 문장 간격 추가
 
             with open(speech_file_path, 'wb') as audio_file:
-                audio_file.write(tts)
+                audio_file.write(tts.render())
 
             st.session_state.speech_file_path = str(speech_file_path)
             st.session_state.success_message = "Speech conversion successful!"
@@ -1,13 +1,26 @@
 import streamlit as st
-from pathlib import Path
 from openai import OpenAI
 import os
 from dotenv import load_dotenv
-from collections import Counter
 import re
 import random
-from pydub import AudioSegment
+import time
+import uuid
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from script_parser import parse_script
+from planner import plan_exam, exam_key, COALESCE_FORMATS
+from tts_engine import synthesize_iter, fetch_speech_shared, get_default_hedger, DEFAULT_WORKERS, RESPONSE_FORMATS, DEFAULT_RESPONSE_FORMAT
+from clip_cache import get_default_cache
+from audio_assembly import (Timeline, StreamingEncoder, DecodedClips, DEFAULT_FORMAT, assemble_exam, cache_clip_mp3,
+                            rebuild_exam)
+from mp3_splice import Mp3Splicer
+from job_store import get_default_store
+from rate_limit import get_default_limiter
+from concurrency import get_default_controller
+from scheduler import get_default_scheduler
+from jobs import BackgroundJob
+from coalesce import synthesize_coalesced, batch_clip_keys
 
 # CSS 스타일 추가
 st.markdown(
@@ -39,91 +52,163 @@ def is_input_exist(text):
     pattern = re.compile(r'[a-zA-Z가-힣]')
     return not bool(pattern.search(text))
 
-def which_eng_kor(input_s):
-    count = Counter(input_s)
-    k_count = sum(count[c] for c in count if ord('가') <= ord(c) <= ord('힣'))
-    e_count = sum(count[c] for c in count if 'a' <= c.lower() <= 'z')
-    return "ko" if k_count > e_count else "en"
-
-def extract_question(text):
-    match = re.match(r'^\s*(\d+)\s*\.?\s*번?\s*(.*)', text)
-    if match:
-        number = match.group(1).strip()
-        question = match.group(2).strip()
-        return number, question
-    return None, text.lstrip()
-
-
-def num_to_korean(n):
-    digit = ["", "일", "이", "삼", "사", "오", "육", "칠", "팔", "구"]
-    unit  = ["", "십", "백", "천"]
-    n = int(n)
-    if n == 0:
-        return "영"
-    result = ""
-    str_n = str(n)
-    length = len(str_n)
-    for i, ch in enumerate(str_n):
-        num = int(ch)
-        u = unit[length - i - 1]
-        if num == 0:
-            continue
-        # 만약 자릿수가 십·백·천이고 값이 1이면 '일' 생략
-        if num == 1 and u != "":
-            result += u
-        else:
-            result += digit[num] + u
-    return result
-
-
-def merge_lines(lines):
-    merged = []
-    current_sentence = ""
-    for line in lines:
-        line = line.strip()
-        if line.endswith('.') or line.endswith('?') or line.endswith('!'):
-            current_sentence += " " + line
-            merged.append(current_sentence.strip())
-            current_sentence = ""
-        else:
-            current_sentence += " " + line
-    if current_sentence:
-        merged.append(current_sentence.strip())
-    return merged
-
-def get_voice(option, idx, gender):
-    if option in ["random", "order"]:
-        if gender == "female":
-            voices = ['alloy', 'fable', 'nova', 'shimmer']
-        else:
-            voices = ['echo', 'onyx']
-        if option == "random":
-            selected_voice = random.choice(voices)
-            print(f"Randomly selected {gender} voice: {selected_voice}")
-            return selected_voice
-        else:
-            selected_voice = voices[idx % len(voices)]
-            print(f"Sequentially selected {gender} voice: {selected_voice}")
-            return selected_voice
+def parse_gap_overrides(text):
+    # "13=15, 29=5" → {"13": 15000.0, "29": 5000.0} (해당 문제가 끝난 뒤의 간격, 초 → ms)
+    overrides = {}
+    for part in re.split(r'[,\n]', text or ""):
+        m = re.match(r'^\s*(\d+)\s*[=:]\s*(\d+(?:\.\d+)?)\s*$', part)
+        if m:
+            overrides[m.group(1)] = float(m.group(2)) * 1000
+    return overrides
+
+
+def reassemble(job, interline, internum, overrides, cache, store, key=None):
+    # 저장해 둔 문장으로 간격만 바꿔 다시 조립 (API 호출 없음)
+    # 생성할 때 미리 만들어 둔 문장별 MP3 를 프레임 잇기로 바로 잇는다 (없으면 한 번에 인코딩)
+    temp_path = store.new_temp_path(".mp3")
+    try:
+        rebuild_exam(job["timeline"], job["clip_keys"], job["response_format"], cache, temp_path,
+                     interline, internum, overrides)
+    except BaseException:
+        store.discard(temp_path)
+        raise
+    return store.publish(temp_path, key=key)
+
+
+def render_preview(client, plan, response_format, interline, controller, tenant):
+    # 한 문제만 합성해 MP3 바이트로 (우선 처리 줄로 보내 쌓여 있는 전체 시험 작업을 앞지른다)
+    clips = synthesize_iter(client, plan.requests, max_workers=max(1, len(plan)), cache=get_default_cache(),
+                            limiter=get_default_limiter(), controller=controller,
+                            scheduler=get_default_scheduler(), tenant=tenant, priority=True,
+                            hedger=get_default_hedger())
+    clips = (data for _, data in clips)
+    if response_format == "mp3":
+        return assemble_exam(plan.timeline, clips, Mp3Splicer(), "mp3", interline).render()
+    timeline = assemble_exam(plan.timeline, clips, Timeline(DEFAULT_FORMAT), response_format, interline)
+    return timeline.render().export(BytesIO(), format="mp3").getvalue()
+
+
+def generate_exam(job, client, plan, options):
+    # 백그라운드 스레드에서 시험 전체를 합성·조립해 공개한다 (st.* 를 부르지 않는다)
+    # job.token 이 멈추면 보내는 중인 요청을 끊고 임시 파일을 지운다. 이미 받은 문장은 캐시에 남는다
+    store = get_default_store()
+    # 세션마다 따로 쓰는 임시 파일 (다른 사용자의 음원을 덮어쓰지 않음)
+    speech_file_path = store.new_temp_path(".mp3")
+    print(f"Plan: {len(plan)} requests ({plan.reused()} repeated sentences reused), seed {plan.seed}")
+
+    # 같은 계획으로 만들다 멈춘 작업이 있으면, 끝났다고 남긴 문장 중 캐시에 아직 있는 것은 요청하지 않고
+    # 캐시에서 읽는다. 나머지(지워진 것 포함)만 요청한다
+    # 묶어 요청하는 계획이면 묶음 단위로 (남은 묶음의 요청·캐시 키가 처음과 같도록)
+    output_key = options["output_key"]
+    cache = get_default_cache()
+    clip_keys = batch_clip_keys(plan.requests, plan.batches)
+    checkpoint = store.load_checkpoint(output_key)
+    if checkpoint and checkpoint.get("clip_keys") == clip_keys:
+        restored = {i for batch in plan.batches
+                    if all(clip_keys[i] in checkpoint["done_keys"] and cache.contains(clip_keys[i]) for i in batch)
+                    for i in batch}
     else:
-        print(f"Selected {gender} voice: {option}")
-        return option
-
-def extract_speaker(text):
-    m_match = re.match(r'^\s*M\s*:?\s*(.*)', text)
-    if m_match:
-        return "male", m_match.group(1).strip()
-    w_match = re.match(r'^\s*W\s*:?\s*(.*)', text)
-    if w_match:
-        return "female", w_match.group(1).strip()
-    return None, text
-
-def extract_tone(text):
-    # 문장 맨 앞 [지시어] 를 뽑아내고 본문에서 제거
-    m = re.match(r'^\s*\[([^\]]+)\]\s*(.*)', text)
-    if m:
-        return m.group(1).strip(), m.group(2)
-    return None, text
+        store.save_checkpoint(output_key, {"clip_keys": clip_keys, "total": len(clip_keys)})
+        restored = set()
+    resumed = len(restored)
+    missing = [i for i in range(len(plan)) if i not in restored]
+    position = {i: n for n, i in enumerate(missing)}
+    batches = [[position[i] for i in batch] for batch in plan.batches if batch[0] in position]
+    if resumed:
+        print(f"Resuming: {resumed}/{len(plan)} sentences restored from the checkpoint, requesting {len(missing)}")
+
+    # 문장들을 동시에 합성하면서, 앞 문장부터 준비되는 대로 대본 순서대로 이어 붙인다
+    # 이미 만든 적 있는 문장은 캐시에서 가져온다
+    stats = {}
+    response_format = options["response_format"]
+    # MP3 를 디코딩해 이어 붙일 때는 받는 동안 디코딩해 두어, 마지막 바이트 뒤에 디코딩을 기다리지 않는다
+    decoded = DecodedClips(DEFAULT_FORMAT) if response_format == "mp3" and not options["splice_mp3"] else None
+    # 모든 세션이 같은 제한기(분당 요청 수·글자 수)를 거쳐 API 를 부른다
+    # 묶어 요청하는 계획이면 묶음마다 한 번 요청하고 문장 사이 무음에서 다시 자른다
+    clip_iter = synthesize_coalesced(client, [plan.requests[i] for i in missing], batches,
+                                     max_workers=options["max_workers"], cache=cache, stats=stats,
+                                     limiter=get_default_limiter(),
+                                     controller=get_default_controller() if options["adaptive"] else None,
+                                     scheduler=get_default_scheduler(), tenant=options["tenant"],
+                                     hedger=get_default_hedger(), cancel=job.token, decoded=decoded)
+    job.progress(0, len(plan))
+    if response_format == "mp3" and options["splice_mp3"]:
+        # MP3 프레임을 그대로 잇고 무음 프레임을 끼워 넣음 (ffmpeg 사용 안 함)
+        assembler = Mp3Splicer()
+    elif options["stream_output"]:
+        # 받는 즉시 인코더로 흘려보내 파일을 조금씩 씀
+        assembler = StreamingEncoder(speech_file_path, DEFAULT_FORMAT)
+    else:
+        assembler = Timeline(DEFAULT_FORMAT)   # 이 작업의 출력 형식(24kHz·모노·16비트)
+    # 간격만 바꿀 때 프레임 잇기로 바로 다시 만들 수 있도록, 문장별 MP3 를 합성하는 동안 옆에서 만들어 둔다
+    prebuild = ThreadPoolExecutor(max_workers=2) if response_format != "mp3" else None
+
+    def restored_and_fetched():
+        # 끝난 문장은 캐시에서, 나머지는 요청한 순서대로 받아 대본 순서로 내보내고, 받을 때마다 체크포인트에 한 줄 남긴다
+        for i in range(len(plan)):
+            if i in restored:
+                data = cache.get(clip_keys[i])
+                if data is None:
+                    # 확인한 뒤 용량 정리로 지워졌으면 그 문장만 다시 요청
+                    data, _, _ = fetch_speech_shared(client, plan.requests[i], cache, limiter=get_default_limiter(),
+                                                     cancel=job.token)
+                    cache.put(clip_keys[i], data)
+            else:
+                _, data = next(clip_iter)      # 남은 요청도 대본 순서대로 나온다
+                store.mark_done(output_key, clip_keys[i])
+            job.progress(i + 1, len(plan))
+            yield i, data
+
+    def clips():
+        for i, data in restored_and_fetched():
+            if prebuild is not None:
+                prebuild.submit(cache_clip_mp3, cache, clip_keys[i], data, response_format)
+            yield decoded.take(clip_keys[i], data) if decoded is not None else data
+
+    try:
+        assemble_exam(plan.timeline, clips(), assembler, response_format,
+                      options["interline"], options["internum"], options["gap_overrides"])
+        for _ in clip_iter:
+            pass  # 남은 것이 없으면 측정값만 마무리
+        job.token.check()
+        if prebuild is not None:
+            prebuild.shutdown(wait=True)
+    except BaseException:
+        if prebuild is not None:
+            prebuild.shutdown(wait=False, cancel_futures=True)
+        clip_iter.close()
+        if isinstance(assembler, StreamingEncoder):
+            assembler.abort()
+        store.discard(speech_file_path)
+        raise
+
+    if isinstance(assembler, Mp3Splicer):
+        speech_file_path.write_bytes(assembler.render())
+    elif isinstance(assembler, StreamingEncoder):
+        assembler.close()
+    else:
+        tts = assembler.render()  # 한 번에 이어 붙이기
+        tts.export(speech_file_path, format="mp3")
+    # 다 만든 파일만 계획 해시 이름으로 공개 (다음에 같은 계획이면 그대로 재사용)
+    path = store.publish(speech_file_path, key=output_key)
+    store.clear_checkpoint(output_key)
+    # 간격만 바꿀 때 다시 쓰도록 타임라인과 문장 캐시 키를 함께 돌려준다
+    last_job = {
+        "key": job.key,
+        "timeline": plan.timeline,
+        "clip_keys": clip_keys,
+        "response_format": response_format,
+        "gaps": options["gaps"],
+    }
+    # 대본에서 같은 문장을 한 번만 합성해 아낀 요청 수
+    stats["deduplicated"] = plan.reused()
+    return {"path": str(path), "stats": stats, "last_job": last_job, "resumed": resumed}
+
+
+@st.cache_resource
+def get_client(api_key):
+    # 세션마다 새 클라이언트를 만들지 않고 프로세스 안에서 연결을 함께 쓴다
+    return OpenAI(api_key=api_key)
 
 
 load_dotenv()
@@ -133,7 +218,7 @@ api_key = os.getenv('OPENAI_API_KEY')
 if not api_key:
     st.error("API key not found. Please set the OPENAI_API_KEY environment variable.")
 else:
-    client = OpenAI(api_key=api_key)
+    client = get_client(api_key)
 
     st.markdown(
         '''
@@ -170,15 +255,30 @@ else:
 
     interline = 1000*col_interval.slider("대사 간격(s)", min_value=0.2, max_value=2.0, value=0.7, step=0.1, key="interline", disabled=False, help="문장 사이의 무음 구간 길이")
     internum = col_interval.slider("문제 간격(s)", min_value=1, max_value=25, value=10, key="internum", disabled=False, help="문제와 문제 사이의 무음 구간 길이")
-
-    # 무음을 미리 생성
-    interline_silence = AudioSegment.silent(duration=interline)
-    internum_silence = AudioSegment.silent(duration=internum * 1000)
-
-    if 'female_sequence' not in st.session_state:
-        st.session_state.female_sequence = 0
-    if 'male_sequence' not in st.session_state:
-        st.session_state.male_sequence = 0
+    gap_overrides = parse_gap_overrides(col_interval.text_input("문제별 간격", key="gap_overrides", placeholder="13=15, 29=5",
+        help="문제번호=간격(초). 해당 문제가 끝난 뒤의 간격만 따로 바꿉니다."))
+    max_workers = col_interval.slider("동시 요청 수", min_value=1, max_value=16, value=DEFAULT_WORKERS, key="max_workers", help="한 번에 보내는 음성 합성 요청 수 (1이면 한 문장씩 순서대로)")
+    adaptive = col_interval.checkbox("동시 요청 자동 조절", value=True, key="adaptive",
+        help="API 가 느려지거나 429/5xx 를 보내면 동시 요청 수를 줄이고, 원활하면 늘립니다. 위 값은 상한으로 씁니다.")
+    response_format = col_interval.selectbox("전송 형식", RESPONSE_FORMATS, index=RESPONSE_FORMATS.index(DEFAULT_RESPONSE_FORMAT), key="response_format",
+        help="API 에서 받는 음성 형식. pcm/wav 는 디코딩 없이 바로 이어 붙이고(용량 큼), mp3/opus 는 용량이 작지만 문장마다 디코딩합니다.")
+    splice_mp3 = col_interval.checkbox("MP3 바로 잇기", value=False, key="splice_mp3", disabled=response_format != "mp3",
+        help="mp3 형식일 때 디코딩·재인코딩 없이 MP3 프레임을 그대로 이어 붙입니다. (가장 빠름)")
+    stream_output = col_interval.checkbox("스트리밍 출력", value=True, key="stream_output", disabled=response_format == "mp3" and splice_mp3,
+        help="문장이 준비되는 대로 바로 인코딩해 파일에 씁니다. 긴 시험도 메모리를 적게 씁니다.")
+    coalesce = col_interval.checkbox("같은 목소리 문장 묶어 요청", value=False, key="coalesce", disabled=response_format not in COALESCE_FORMATS,
+        help="pcm/wav 형식일 때 한 문제 안에서 이어지는 같은 목소리·톤의 문장을 한 번에 요청하고, 문장 사이 무음에서 다시 잘라 씁니다. API 호출 수가 크게 줄어듭니다.")
+
+
+    # 공용 스케줄러에서 이 세션의 작업을 구분하는 이름
+    if 'tenant_id' not in st.session_state:
+        st.session_state.tenant_id = uuid.uuid4().hex[:8]
+
+    # random 음성을 고를 때 쓰는 seed. 같은 seed·대본·설정이면 항상 같은 음성이 나온다
+    if 'voice_seed' not in st.session_state:
+        st.session_state.voice_seed = random.randrange(2 ** 31)
+    if col_voice.button("🎲 음성 다시 섞기", help="random 으로 고른 음성을 새로 고릅니다."):
+        st.session_state.voice_seed = random.randrange(2 ** 31)
 
     col_btn2, col_btn3 = st.columns([10, 3])
     success_message = st.empty()
@@ -213,121 +313,160 @@ W: Number Five.
 문장, 문제 간격을 조절할 수 있습니다. (각색된 예시 대본 원본 출처:EBS)""", language="haskell")
     st.session_state.input_text = st.text_area("대본 입력란", st.session_state.input_text, key="input_area", height=max(st.session_state.input_text.count('\n') * 26 + 10, 400))
 
-    if col_interval.button("🔊 음원 생성하기", disabled=is_input_exist(st.session_state.input_text),):
-        print("Generating audio...")
-
-        overlay_container = st.empty()
-        overlay_container.markdown("""
-        <style>
-        .overlay {
-            position: fixed;top: 0;left: 0;width: 100%;height: 100%;
-            background: rgba(0, 0, 0, 0.7);z-index: 999;display: flex;
-            justify-content: center;align-items: center;                }
-        .spinner {margin-bottom: 10px;}
-        </style>
-        <div class="overlay"><div><div class="spinner">
-                    <span class="fa fa-spinner fa-spin fa-3x"></span>
-                </div><div style="color: white;">음원을 출력하는 중...</div></div></div>""", unsafe_allow_html=True)
+    # 합성 전에 모든 문장의 음성·톤·속도를 확정 (같은 입력이면 항상 같은 요청)
+    plan = plan_exam(parse_script(st.session_state.input_text), ko_option, female_voice, male_voice,
+                     speed=speed_rate, response_format=response_format, seed=st.session_state.voice_seed,
+                     coalesce=coalesce)
+    with st.expander(f"합성 계획 보기 ({len(plan.speech_numbers)}문장, 서로 다른 문장 {len(plan)}개, API 요청 {plan.calls()}회)"):
+        st.dataframe(plan.rows(), use_container_width=True)
+    # 한 문제만 미리 듣기 (톤 지시를 고칠 때 전체를 다시 만들지 않고 바로 확인)
+    col_preview, col_preview_btn = st.columns([10, 3])
+    numbers = plan.question_numbers()
+    preview_number = col_preview.selectbox("미리 들을 문제", numbers, key="preview_number",
+                                           format_func=lambda n: f"{n}번" if n else "안내문")
+    if col_preview_btn.button("▶ 이 문제만 미리 듣기", disabled=not numbers):
         try:
-            speech_file_path = Path("speech.mp3")
-            input_text = st.session_state.input_text
-            lines = input_text.split('\n')
-            sentences = merge_lines(lines)
-            tts = AudioSegment.silent(duration=0)  # 초기 음성
-            current_number = None
-            is_first_question = True  # 첫 문제 여부 확인 변수 추가
-
-            current_female_voice = get_voice(female_voice, st.session_state.female_sequence, "female")
-            current_male_voice = get_voice(male_voice, st.session_state.male_sequence, "male")
-            current_voice = ko_option
-            for sentence in sentences:
-                # 앞뒤 공백 제거
-                sentence = sentence.lstrip()
-                # 언어 판별
-                lang = which_eng_kor(sentence)
-
-                # ✅ 톤 지시 추출 ([Excited], [Calmly] 등)
-                tone_hint, sentence = extract_tone(sentence)
-
-                # ✅ 성별 힌트 추출 (M:, W: 제거)
-                gender_hint, sentence = extract_speaker(sentence)
-
-                # ✅ 문제 번호 추출 (번호·번 제거)
-                number, sentence = extract_question(sentence)
-
-                # ✅ 문제 번호 읽기
-                if number and number != current_number:
-                    current_number = number
-                    if female_voice in ["random", "order"]:
-                        st.session_state.female_sequence += 1
-                    if male_voice in ["random", "order"]:
-                        st.session_state.male_sequence += 1
-
-                    if not is_first_question:
-                        tts += internum_silence
-                    is_first_question = False
-
-                if number:
-                    korean_number = num_to_korean(number) + "번 문제입니다."
-                    text_to_convert = f"{korean_number} {sentence}"
-                else:
-                    text_to_convert = sentence
-
-                # ✅ 성별 지표가 있을 때만 목소리 변경
-                # ——— 음성 지표가 있을 때만 목소리 변경 ———
-                if gender_hint == "female":
-                    current_voice = get_voice(female_voice, st.session_state.female_sequence, "female")
-                elif gender_hint == "male":
-                    current_voice = get_voice(male_voice, st.session_state.male_sequence, "male")
-
-                # ——— 번호만 있는 줄이라면 시퀀스만 증가 (목소리는 그대로) ———
-                elif number and number != current_number:
-                    if female_voice in ["random", "order"]:
-                        st.session_state.female_sequence += 1
-                    if male_voice   in ["random", "order"]:
-                        st.session_state.male_sequence   += 1
-
-                # ——— 그 외(지표도 번호도 없으면) current_voice 유지 ———
-                else:
-                    # current_voice 를 변경하지 않음
-                    pass
-
-                # ——— 안전장치: 혹시 None 이면 기본 한국어 음성 사용 ———
-                if current_voice is None:
-                    current_voice = ko_option
-
-                if text_to_convert.strip():
-                    # 스트리밍 API 사용
-                    with client.audio.speech.with_streaming_response.create(
-                        model="gpt-4o-mini-tts",           # 최신 속도 지원 모델
-                        voice=current_voice,
-                        input=text_to_convert,
-                        speed=speed_rate,
-                        instructions=tone_hint or "Speak clearly and calmly like a teacher, with a steady pace, natural pronunciation, emphasis on key phrases."
-
-                    ) as response:
-                        audio_bytes = BytesIO()
-                        # 바이트 청크를 받아서 버퍼에 쓴 뒤
-                        for chunk in response.iter_bytes():
-                            audio_bytes.write(chunk)
-                        # MP3 로 디코딩
-                        audio_chunk = AudioSegment.from_file(BytesIO(audio_bytes.getvalue()), format="mp3")
-                        tts += audio_chunk
-
-                    # 문장 사이 무음
-                    tts += interline_silence
-
-            tts.export(speech_file_path, format="mp3")
-            st.session_state.speech_file_path = str(speech_file_path)
-            st.session_state.success_message = "음성 변환이 성공적으로 완료되었습니다!"
-            st.session_state.en_warning_message = "고지 사항: 이 목소리는 인공지능(AI)으로 생성된 것이며, 실제 사람의 목소리가 아닙니다."
-            print("Audio file saved successfully.")
-
+            t0 = time.perf_counter()
+            st.session_state.preview_audio = render_preview(
+                client, plan.question(preview_number), response_format, interline,
+                get_default_controller() if adaptive else None, st.session_state.tenant_id)
+            st.session_state.preview_message = (
+                f"{preview_number or '안내문'}{'번' if preview_number else ''} 미리 듣기 ({time.perf_counter() - t0:.1f}초)")
+        except Exception as e:
+            st.session_state.pop("preview_audio", None)
+            st.session_state.preview_message = f"An error occurred: {e}"
+            print(f"An error occurred: {e}")
+    if 'preview_message' in st.session_state:
+        col_preview.caption(st.session_state.preview_message)
+    if 'preview_audio' in st.session_state:
+        col_preview.audio(st.session_state.preview_audio, format="audio/mp3")
+
+    if adaptive:
+        # 프로세스 전체의 동시 요청 한도와 최근 조절 기록
+        metrics = get_default_controller().snapshot()
+        with st.expander(f"동시 요청 조절 현황 (현재 {metrics['limit']}개)"):
+            st.write({k: v for k, v in metrics.items() if k != "decisions"})
+            st.dataframe(metrics["decisions"][::-1], use_container_width=True)
+    # 세션별 대기열 (여러 선생님이 동시에 만들 때 순서대로 돌아가며 처리)
+    queues = get_default_scheduler().snapshot()
+    if queues:
+        with st.expander(f"작업 대기열 현황 ({len(queues)}개 세션)"):
+            st.dataframe([{"세션": "나" if tenant == st.session_state.tenant_id else tenant, "대기": q["queued"],
+                           "처리 중": q["running"], "완료": q["completed"], "평균 대기(ms)": q["avg_wait_ms"],
+                           "최대 대기(ms)": q["max_wait_ms"]} for tenant, q in queues.items()],
+                         use_container_width=True)
+
+    # 같은 요청으로 만든 음원이 있으면 간격만 바꿀 때 API 를 다시 부르지 않는다
+    job_key = tuple(plan.requests)
+    # 요청·간격까지 같으면 완성된 음원을 그대로 다시 쓴다
+    output_key = exam_key(plan, interline, internum * 1000, gap_overrides)
+    generate_clicked = col_interval.button("🔊 음원 생성하기", disabled=is_input_exist(st.session_state.input_text),)
+    last_job = st.session_state.get("last_job")
+    if (not generate_clicked and last_job and last_job["key"] == job_key
+            and last_job["gaps"] != (interline, internum, gap_overrides)):
+        try:
+            t0 = time.perf_counter()
+            store = get_default_store()
+            path = store.lookup(output_key) or reassemble(last_job, interline, internum * 1000, gap_overrides,
+                                                          get_default_cache(), store, output_key)
+            last_job["gaps"] = (interline, internum, gap_overrides)
+            st.session_state.speech_file_path = str(path)
+            st.session_state.success_message = f"간격만 다시 적용했습니다. ({time.perf_counter() - t0:.2f}초, API 호출 없음)"
+            print(f"Reassembled with new gaps in {time.perf_counter() - t0:.2f}s")
         except Exception as e:
             st.session_state.success_message = f"An error occurred: {e}"
             print(f"An error occurred: {e}")
-        overlay_container.empty()
-        st.balloons()
+
+    # 같은 계획으로 이미 만든 음원이면 API·인코더 없이 바로 돌려준다
+    cached_path = get_default_store().lookup(output_key) if generate_clicked else None
+    if cached_path is not None:
+        store = get_default_store()
+        st.session_state.speech_file_path = str(cached_path)
+        st.session_state.last_job = {
+            "key": job_key,
+            "timeline": plan.timeline,
+            "clip_keys": batch_clip_keys(plan.requests, plan.batches),
+            "response_format": response_format,
+            "gaps": (interline, internum, gap_overrides),
+        }
+        st.session_state.success_message = (
+            f"같은 설정으로 만든 음원을 바로 불러왔습니다. (저장된 음원 재사용 {store.hits}회 / 새로 생성 {store.misses}회)")
+        st.session_state.en_warning_message = "고지 사항: 이 목소리는 인공지능(AI)으로 생성된 것이며, 실제 사람의 목소리가 아닙니다."
+        print(f"Exam cache hit: {output_key} (hits {store.hits}, misses {store.misses})")
+
+    elif generate_clicked:
+        print("Generating audio...")
+        # 합성은 백그라운드 작업으로 돌리고, 이 실행과 다음 실행들은 진행 상황만 보여 준다
+        options = {
+            "response_format": response_format, "splice_mp3": splice_mp3, "stream_output": stream_output,
+            "interline": interline, "internum": internum * 1000, "gap_overrides": gap_overrides,
+            "max_workers": max_workers, "adaptive": adaptive, "tenant": st.session_state.tenant_id,
+            "output_key": output_key, "gaps": (interline, internum, gap_overrides),
+        }
+        running = st.session_state.get("job")
+        if running is not None and running.running():
+            running.cancel()
+        st.session_state.job = BackgroundJob(job_key, lambda job: generate_exam(job, client, plan, options)).start()
+
+    job = st.session_state.get("job")
+    # 지난번에 (이 세션이든 서버가 다시 시작되기 전이든) 같은 계획으로 만들다 멈춘 작업 안내
+    if job is None and not generate_clicked:
+        checkpoint = get_default_store().load_checkpoint(output_key)
+        if checkpoint and checkpoint.get("done", 0) < checkpoint.get("total", 0):
+            st.info(f"이 대본으로 만들다 멈춘 작업이 있습니다 ({checkpoint['done']}/{checkpoint['total']}문장). "
+                    f"'음원 생성하기'를 누르면 끝난 문장은 캐시에서 읽고 나머지만 만듭니다.")
+    # 대본(또는 음성 설정)이 바뀌면 진행 중인 작업을 멈춘다
+    if job is not None and job.running() and job.key != job_key:
+        job.cancel()
+        print("Script changed, cancelling the running job")
+    if job is not None and job.running():
+        progress_bar = st.progress(0.0, text="음원을 출력하는 중...")
+        if col_interval.button("⏹ 생성 멈추기", key="stop_job"):
+            job.cancel()
+        # 다른 위젯을 누르면 Streamlit 이 이 반복을 끊고 다시 실행한다 (작업은 계속되거나 멈춤 버튼으로 멈춤)
+        while job.running():
+            progress_bar.progress(job.done / job.total if job.total else 0.0,
+                                  text=f"음원을 출력하는 중... {job.done}/{job.total}문장"
+                                       + (" (멈추는 중)" if job.token.cancelled else ""))
+            time.sleep(0.2)
+        progress_bar.empty()
+
+    if job is not None and not job.running():
+        del st.session_state.job
+        if job.cancelled:
+            st.session_state.success_message = (
+                f"음원 생성을 멈췄습니다. ({job.done}/{job.total}문장 완료 · 받은 문장은 다시 생성할 때 재사용됩니다)")
+            st.session_state.pop("speech_file_path", None)
+            success_message.info(st.session_state.success_message)
+            print("Job cancelled.")
+        elif job.error is not None:
+            st.session_state.success_message = f"An error occurred: {job.error}"
+            if job.done:
+                st.session_state.success_message += (f" (다시 생성하면 끝난 {job.done}문장은 캐시에서 읽고 "
+                                                     f"나머지만 만듭니다)")
+            print(f"An error occurred: {job.error}")
+        else:
+            stats = job.result["stats"]
+            resumed = job.result["resumed"]
+            saved_calls = stats["saved_calls"]
+            deduplicated = stats["deduplicated"]
+            st.session_state.speech_file_path = job.result["path"]
+            st.session_state.last_job = job.result["last_job"]
+            st.session_state.success_message = (
+                f"음성 변환이 성공적으로 완료되었습니다! "
+                f"({stats['requests']}문장, 동시 {stats.get('concurrency', stats['workers'])}개{' (자동)' if 'concurrency' in stats else ''}, {stats['elapsed']:.1f}초 · 순차 대비 약 {stats['speedup']:.1f}배, 재사용 {stats['cache_hits'] + stats['shared']}문장"
+                f"{f' · 끝난 {resumed}문장은 체크포인트에서 이어 받음' if resumed else ''}"
+                f"{f' · 같은 문장을 한 번만 합성해 API 호출 {deduplicated}회 절약' if deduplicated else ''}"
+                f"{f' · 묶어 요청해 API 호출 {saved_calls}회 절약' if saved_calls else ''})")
+            st.session_state.en_warning_message = "고지 사항: 이 목소리는 인공지능(AI)으로 생성된 것이며, 실제 사람의 목소리가 아닙니다."
+            print("Audio file saved successfully.")
+            st.balloons()
+
+    # 오래되어 정리된 파일이면 다시 생성하도록 안내
+    if 'speech_file_path' in st.session_state and not os.path.exists(st.session_state.speech_file_path):
+        del st.session_state.speech_file_path
+        st.session_state.success_message = "음원 파일이 만료되었습니다. 다시 생성해 주세요."
+        success_message.info(st.session_state.success_message)
 
     if 'speech_file_path' in st.session_state:
         success_message.success(st.session_state.success_message)
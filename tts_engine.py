@@ -0,0 +1,440 @@
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError, wait
+from contextlib import nullcontext
+from io import BytesIO
+
+from clip_cache import clip_key
+from jobs import CancelToken, JobCancelled
+from rate_limit import retry_after_of
+
+DEFAULT_MODEL = "gpt-4o-mini-tts"
+DEFAULT_INSTRUCTIONS = "Speak clearly and calmly like a teacher, with a steady pace, natural pronunciation, emphasis on key phrases."
+DEFAULT_WORKERS = 8
+MAX_RETRIES = 4             # 한 문장이 429·5xx·연결 오류로 실패했을 때 다시 보내는 최대 횟수
+BACKOFF_BASE = 0.5          # 재시도 대기: 0 ~ min(BACKOFF_MAX, BACKOFF_BASE * 2^n) 초 사이 무작위 (full jitter)
+BACKOFF_MAX = 8.0
+
+# API 에 요청할 음성 형식. pcm 은 24kHz·모노·16비트 원시 샘플이라 디코딩(ffmpeg)이 필요 없다.
+RESPONSE_FORMATS = ["pcm", "wav", "mp3", "opus"]
+DEFAULT_RESPONSE_FORMAT = "pcm"
+
+# 한 문장을 합성하는 데 필요한 모든 값
+SpeechRequest = namedtuple("SpeechRequest", ["model", "voice", "text", "speed", "instructions", "response_format"],
+                           defaults=["mp3"])
+
+
+def is_retryable(error):
+    # 다시 보내면 성공할 수 있는 오류: 429, 408/409, 5xx, 연결·시간 초과
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return isinstance(error, OSError) or type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def backoff_delay(attempt):
+    # 여러 작업자가 한꺼번에 다시 보내지 않도록 대기 시간을 고르게 흩뜨린다
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def fetch_speech(client, request, limiter=None, controller=None, cancel=None, decoded=None, priority=False):
+    # 스트리밍 API 로 한 문장을 받아 request.response_format 형식의 바이트로 반환
+    data, decoder = _fetch_speech(client, request, limiter, controller, cancel, decoded, priority)
+    if decoder is not None:
+        decoded.finish(request_key(request), decoder)
+    return data
+
+
+def _fetch_speech(client, request, limiter=None, controller=None, cancel=None, decoded=None, priority=False,
+                  on_sent=None):
+    # fetch_speech() 와 같되 (바이트, 그 바이트를 받으며 채운 디코더) 를 돌려주고 decoded 에 맡기지는 않는다.
+    # 같은 문장을 두 번 보낼 때(hedge) 먼저 끝난 쪽의 디코더만 맡기도록, 맡기는 일은 부른 쪽이 한다
+    # 429·5xx·연결 오류는 시험 전체를 버리지 않고 이 문장만 MAX_RETRIES 번까지 다시 보낸다
+    # limiter 가 있으면 토큰을 얻을 때까지 기다렸다 보내고, 429 를 받으면 Retry-After 만큼 모두 멈춘다
+    # controller(AdaptiveConcurrency) 가 있으면 동시 요청 자리를 얻어 보내고, 첫 바이트 지연·오류를 알려 준다
+    # cancel(CancelToken) 이 멈추면 기다리던 중이든 받는 중이든 응답을 닫고 JobCancelled 를 올린다
+    # decoded(DecodedClips) 가 있으면 받는 동안 청크를 디코더에 흘려 넣어, 다 받았을 때 바로 쓸 PCM 을 남긴다
+    # priority=True(한 문제 미리 듣기)면 limiter 의 줄을 건너뛰고 controller 의 예비 자리를 쓴다
+    # on_sent() 는 토큰과 동시 요청 자리를 얻어 실제로 요청을 보낼 때 부른다
+    kwargs = dict(model=request.model, voice=request.voice, input=request.text,
+                  response_format=request.response_format)
+    if request.speed is not None:
+        kwargs["speed"] = request.speed
+    if request.instructions:
+        kwargs["instructions"] = request.instructions
+    attempt = 0
+    while True:
+        if cancel is not None:
+            cancel.check()
+        if limiter is not None:
+            limiter.acquire(len(request.text), cancel, priority)
+        if controller is not None:
+            controller.acquire(cancel, priority)
+        if on_sent is not None:
+            on_sent()
+        start = time.perf_counter()
+        first_byte = None
+        decoder = decoded.start(request) if decoded is not None else None
+        try:
+            with client.audio.speech.with_streaming_response.create(**kwargs) as response:
+                # 멈추면 다른 스레드에서 응답을 닫아 받던 중인 연결을 바로 끊는다
+                with cancel.on_cancel(response.close) if cancel is not None else nullcontext():
+                    audio_bytes = BytesIO()
+                    for chunk in response.iter_bytes():
+                        if first_byte is None:
+                            first_byte = time.perf_counter() - start
+                        audio_bytes.write(chunk)
+                        if decoder is not None:
+                            decoder.feed(chunk)
+            if cancel is not None:
+                cancel.check()      # 끊긴 연결이 오류 없이 끝났을 수도 있다
+        except BaseException as e:
+            # 중간에 멈춘 경우(KeyboardInterrupt 등)에도 동시 요청 자리는 돌려준다
+            if cancel is not None and cancel.cancelled and not isinstance(e, JobCancelled):
+                e = JobCancelled()
+            if controller is not None:
+                controller.release(error=e if isinstance(e, Exception) else None)
+            if isinstance(e, JobCancelled):
+                raise e
+            if not isinstance(e, Exception) or not is_retryable(e) or attempt >= MAX_RETRIES:
+                raise
+            attempt += 1
+            status = getattr(e, "status_code", None)
+            if status == 429 and limiter is not None:
+                limiter.backoff(retry_after_of(e))     # 다음 acquire() 가 Retry-After 만큼 기다린다
+            elif cancel is not None:
+                cancel.wait(backoff_delay(attempt))
+            else:
+                time.sleep(backoff_delay(attempt))
+            print(f"Retrying after {status or type(e).__name__} ({attempt}/{MAX_RETRIES})")
+        else:
+            if controller is not None:
+                controller.release(first_byte)
+            return audio_bytes.getvalue(), decoder
+
+
+class HedgeAttempt:
+    # HedgePolicy.run() 이 fn 에 넘기는 시도 하나. fn 은 요청을 실제로 보낼 때 sent() 를 부르고,
+    # token(CancelToken) 이 멈추면 이 시도만 멈춘다 (다른 쪽이 먼저 끝났을 때)
+    def __init__(self, duplicate=False):
+        self.duplicate = duplicate      # 늦어서 하나 더 보내는 쪽인지
+        self.token = CancelToken()
+        self.sent_at = None
+        self._sent = threading.Event()
+
+    def sent(self):
+        if self.sent_at is None:        # 다시 보낼 때(재시도)는 처음 보낸 시각을 그대로 둔다
+            self.sent_at = time.perf_counter()
+            self._sent.set()
+
+    def wait_sent(self, timeout):
+        return self._sent.wait(timeout)
+
+
+class HedgePolicy:
+    # 최근 응답 시간의 백분위(p95)를 넘도록 끝나지 않는 요청은 같은 요청을 하나 더 보내(hedge)
+    # 먼저 끝난 쪽을 쓴다. 중복 요청이 너무 많아지지 않도록 전체 요청의 budget 비율까지만 보낸다.
+    def __init__(self, percentile=0.95, min_samples=20, budget=0.1, window=500):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget = budget
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0         # 중복 요청이 먼저 끝난 횟수
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="tts-hedge")
+
+    def threshold(self):
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _try_hedge(self, can_hedge=None):
+        with self._lock:
+            if self.hedges >= self.budget * self.requests:
+                return False
+            if can_hedge is not None and not can_hedge():
+                return False
+            self.hedges += 1
+            return True
+
+    def _finish(self, attempt):
+        # 보낸 뒤 끝날 때까지의 시간만 기록한다
+        if attempt.sent_at is not None:
+            self.record(time.perf_counter() - attempt.sent_at)
+
+    def run(self, fn, can_hedge=None):
+        # fn(attempt) 를 실행하고, 보낸 뒤 threshold 안에 끝나지 않으면 fn 을 한 번 더 보내 먼저 성공한 결과를 돌려준다.
+        # can_hedge() 가 False 면(예: 제한기 토큰이 지금 없음) 하나 더 보내지 않는다
+        # 시간은 attempt.sent() 부터 잰다: 제한기 토큰·동시 요청 자리를 기다린 시간은 서버가 늦은 것이 아니므로 뺀다.
+        # 한쪽이 먼저 성공하면 다른 쪽은 attempt.token 으로 멈춰, 받던 응답을 닫고 동시 요청 자리를 돌려주게 한다
+        with self._lock:
+            self.requests += 1
+        threshold = self.threshold()
+        first = HedgeAttempt()
+        if threshold is None:
+            result = fn(first)
+            self._finish(first)
+            return result
+        primary = self._pool.submit(fn, first)
+        while not primary.done() and not first.wait_sent(0.05):
+            pass        # 아직 줄을 서 있는 중
+        if not primary.done():
+            wait([primary], timeout=max(0.0, first.sent_at + threshold - time.perf_counter()))
+        if primary.done() or not self._try_hedge(can_hedge):
+            result = primary.result()
+            self._finish(first)
+            return result
+        second = HedgeAttempt(duplicate=True)
+        hedge = self._pool.submit(fn, second)
+        attempts = {primary: first, hedge: second}
+        pending = {primary, hedge}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            succeeded = [future for future in done if future.exception() is None]
+            if succeeded or not pending:
+                # 먼저 성공한 쪽을 쓴다 (둘 다 실패하면 그 오류를 올린다). 늦은 쪽은 멈추고 버린다
+                future = succeeded[0] if succeeded else done.pop()
+                for other in pending:
+                    attempts[other].token.cancel()
+                if succeeded:
+                    self._finish(attempts[future])
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                return future.result()
+
+    def snapshot(self):
+        threshold = self.threshold()
+        return {"requests": self.requests, "hedges": self.hedges, "hedge_wins": self.hedge_wins,
+                "threshold_ms": round(threshold * 1000) if threshold is not None else None}
+
+
+_default_hedger = None
+_default_lock = threading.Lock()
+
+
+def get_default_hedger():
+    # 프로세스 안의 모든 세션이 같은 응답 시간 기록(p95)을 나눠 쓴다
+    global _default_hedger
+    with _default_lock:
+        if _default_hedger is None:
+            _default_hedger = HedgePolicy()
+        return _default_hedger
+
+
+def request_key(request):
+    return clip_key(request.model, request.voice, request.text, request.speed, request.instructions,
+                    request.response_format)
+
+
+class SingleFlight:
+    # 같은 키로 동시에 들어온 호출은 먼저 온 하나만 실행하고, 나머지는 끝날 때까지 기다렸다가
+    # 같은 결과(또는 같은 예외)를 받는다. 여러 세션이 같은 문장을 동시에 요청해도 API 호출은 한 번.
+    def __init__(self):
+        self.shared = 0         # 다른 호출의 결과를 받아 간 횟수
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, cancel=None):
+        # 두 번째 값은 다른 호출의 결과를 나눠 받았는지 여부
+        # 먼저 온 호출이 멈춤(JobCancelled)으로 끝나면 기다리던 호출 중 하나가 새로 실행한다
+        # 기다리는 호출은 자기 cancel(CancelToken) 이 멈추면 먼저 온 호출을 두고 바로 JobCancelled 를 올린다
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = self._calls[key] = Future()
+                else:
+                    self.shared += 1
+            if leader:
+                break
+            try:
+                while True:
+                    try:
+                        return future.result(timeout=0.1 if cancel is not None else None), True
+                    except TimeoutError:
+                        cancel.check()
+            except JobCancelled:
+                with self._lock:
+                    self.shared -= 1
+                if cancel is not None and cancel.cancelled:
+                    raise
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return result, False
+
+
+# 프로세스 안의 모든 세션이 함께 쓰는 single-flight
+DEFAULT_FLIGHT = SingleFlight()
+
+
+def fetch_speech_shared(client, request, cache=None, flight=DEFAULT_FLIGHT, limiter=None, controller=None,
+                        hedger=None, cancel=None, decoded=None, priority=False):
+    # (바이트, 캐시 적중, 다른 세션과 나눠 받음) 을 돌려준다.
+    # 캐시 확인도 single-flight 안에서 하므로, 앞선 호출이 막 끝나 캐시에 넣은 문장을 다시 요청하지 않는다
+    key = request_key(request)
+
+    def lookup_or_fetch():
+        data = cache.get(key) if cache is not None else None
+        if data is not None:
+            return data, True
+        if hedger is None:
+            data, decoder = _fetch_speech(client, request, limiter, controller, cancel, decoded, priority)
+        else:
+            def attempt(hedge):
+                # 작업이 멈추면 이 시도도 멈춘다 (hedger 가 늦은 쪽을 멈출 때는 그 시도만)
+                # 하나 더 보내는 쪽은 can_hedge 에서 이미 제한기 토큰을 얻었다
+                with cancel.on_cancel(hedge.token.cancel) if cancel is not None else nullcontext():
+                    return _fetch_speech(client, request, None if hedge.duplicate else limiter, controller,
+                                         hedge.token, decoded, priority, hedge.sent)
+
+            # 제한기에 줄을 서야 하는(한도에 걸린) 동안에는 하나 더 보내 토큰을 쓰지 않는다
+            can_hedge = (lambda: limiter.try_acquire(len(request.text))) if limiter is not None else None
+            # 두 번 보냈으면 먼저 끝난 쪽의 바이트와 디코더만 남기고 늦은 쪽은 멈추고 버린다
+            data, decoder = hedger.run(attempt, can_hedge)
+        if decoder is not None:
+            decoded.finish(key, decoder)
+        if cache is not None:
+            cache.put(key, data)
+        return data, False
+
+    if flight is None:
+        data, hit = lookup_or_fetch()
+        return data, hit, False
+    (data, hit), shared = flight.do(key, lookup_or_fetch, cancel)
+    return data, hit, shared
+
+
+def fetch_speech_cached(client, request, cache=None, flight=DEFAULT_FLIGHT, limiter=None, hedger=None):
+    # 캐시에 있거나 같은 문장을 이미 요청 중이면 API 를 부르지 않는다. 두 번째 값은 재사용 여부
+    data, hit, shared = fetch_speech_shared(client, request, cache, flight, limiter, hedger=hedger)
+    return data, hit or shared
+
+
+def synthesize_iter(client, requests, max_workers=DEFAULT_WORKERS, on_done=None, cache=None, stats=None,
+                    flight=DEFAULT_FLIGHT, limiter=None, controller=None, scheduler=None, tenant=None,
+                    priority=False, hedger=None, cancel=None, decoded=None):
+    # 여러 문장을 동시에 요청하되, 결과는 앞 문장이 준비되는 대로 입력 순서대로 하나씩 내보낸다.
+    # 아직 내보내지 못한 결과가 쌓이지 않도록 동시 요청 수의 2배까지만 미리 요청한다.
+    # stats 에 dict 를 넘기면 끝난 뒤 측정값을 채워 준다.
+    # stats["serial_estimate"] 는 같은 요청을 하나씩 보냈을 때 걸렸을 시간(각 요청 시간의 합)
+    # controller 를 넘기면 max_workers 는 이 작업의 상한이고, 실제 동시 요청 수는 controller 가 정한다
+    # scheduler(FairScheduler) 를 넘기면 작업마다 풀을 만들지 않고 공용 작업자에 tenant 이름으로 맡긴다
+    # (이때도 이 작업이 동시에 맡기는 요청은 max_workers 개까지)
+    # (priority=True 면 쌓여 있는 다른 작업보다 먼저 처리되는 우선 처리 줄로, limiter·controller 에서도 먼저)
+    # hedger(HedgePolicy) 를 넘기면 유난히 늦는 문장은 같은 요청을 하나 더 보내 먼저 온 것을 쓴다
+    # cancel(CancelToken) 이 멈추면 대기 중인 요청은 버리고 보내는 중인 요청은 끊은 뒤 JobCancelled 를 올린다
+    # (이미 받은 문장은 캐시에 남아 다음에 재사용된다)
+    # decoded(DecodedClips) 를 넘기면 API 로 받는 문장은 받는 동안 디코딩해 둔다 (조립할 때 decoded.take())
+    latencies = [0.0] * len(requests)
+    hits = [False] * len(requests)
+    shared = [False] * len(requests)
+    workers = max(1, min(int(max_workers), len(requests) or 1))
+    window = workers * 2
+
+    def run(i):
+        if cancel is not None:
+            cancel.check()
+        t0 = time.perf_counter()
+        data, hits[i], shared[i] = fetch_speech_shared(client, requests[i], cache, flight, limiter, controller,
+                                                       hedger, cancel, decoded, priority)
+        latencies[i] = time.perf_counter() - t0
+        return data
+
+    # 공용 작업자에 맡길 때 이 작업이 동시에 보내는 요청 수를 workers 개로 묶는 자리
+    slots = threading.Semaphore(workers)
+
+    def run_in_slot(i):
+        try:
+            return run(i)
+        finally:
+            slots.release()
+
+    start = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=workers) if scheduler is None else None
+    futures = {}
+    try:
+        submitted = 0
+        for i in range(len(requests)):
+            while submitted < len(requests) and submitted < i + window:
+                if pool is not None:
+                    futures[submitted] = pool.submit(run, submitted)
+                else:
+                    # 자리가 없으면 더 맡기지 않고 앞 문장을 기다린다 (앞 문장이 모두 끝났으면 자리는 늘 있다)
+                    if not slots.acquire(blocking=submitted == i):
+                        break
+                    futures[submitted] = scheduler.submit(tenant, run_in_slot, submitted, priority=priority)
+                submitted += 1
+            future = futures.pop(i)
+            while True:
+                try:
+                    data = future.result(timeout=0.1 if cancel is not None else None)
+                    break
+                except TimeoutError:
+                    cancel.check()
+            if on_done:
+                on_done(i + 1, len(requests))
+            yield i, data
+    finally:
+        # 하나라도 실패하거나 중간에 멈추면 아직 시작하지 않은 요청은 버린다
+        # 멈춘 경우에는 보내는 중인 요청이 끊기기를 기다리지 않고 바로 돌아간다
+        stop_now = cancel is not None and cancel.cancelled
+        if pool is not None:
+            pool.shutdown(wait=not stop_now, cancel_futures=True)
+        else:
+            for future in futures.values():
+                future.cancel()
+            if not stop_now:
+                wait(futures.values())
+    elapsed = time.perf_counter() - start
+
+    serial_estimate = sum(latencies)
+    if stats is None:
+        stats = {}
+    stats.update({
+        "requests": len(requests),
+        "workers": workers,
+        "elapsed": elapsed,
+        "serial_estimate": serial_estimate,
+        "speedup": serial_estimate / elapsed if elapsed > 0 else 1.0,
+        "cache_hits": sum(hits),
+        "shared": sum(shared),     # 다른 세션(또는 같은 작업)의 진행 중인 요청을 나눠 받은 수
+        # 캐시에서 가져온·나눠 받은 요청 번호 (synthesize_coalesced 가 문장 수로 바꿀 때 쓴다)
+        "cache_hit_indices": [i for i, hit in enumerate(hits) if hit],
+        "shared_indices": [i for i, flag in enumerate(shared) if flag],
+    })
+    if controller is not None:
+        stats["concurrency"] = controller.snapshot()["limit"]
+    print(f"Synthesized {len(requests)} sentences with {workers} workers in {elapsed:.2f}s "
+          f"(serial estimate {serial_estimate:.2f}s, x{stats['speedup']:.1f}, cache hits {stats['cache_hits']}, "
+          f"shared {stats['shared']})")
+
+
+def synthesize_all(client, requests, max_workers=DEFAULT_WORKERS, on_done=None, cache=None, flight=DEFAULT_FLIGHT,
+                   limiter=None, controller=None, scheduler=None, tenant=None, priority=False, hedger=None,
+                   cancel=None, decoded=None):
+    # 모든 결과를 입력 순서대로 모아서 돌려준다
+    stats = {}
+    results = [data for _, data in synthesize_iter(client, requests, max_workers, on_done, cache, stats, flight,
+                                                   limiter, controller, scheduler, tenant, priority, hedger,
+                                                   cancel, decoded)]
+    return results, stats